@@ -0,0 +1,4 @@
+"""
+ARGO float data API package.
+"""
+__all__ = ["api", "api_semantic", "database", "langchain_services", "main", "models", "schemas"]
@@ -1,40 +1,102 @@
 # app/api.py
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, AsyncIterator
+from datetime import datetime
+import orjson
 
 from . import langchain_services, schemas
-from .database import get_db
+from .database_async import get_async_db
 
 router = APIRouter()
 
+# List endpoints return typed SQL row mappings as an ORJSONResponse (/floats is
+# streamed), skipping FastAPI's response_model validation of every row.
+# response_model stays on the routes so the docs still show the schemas.
+
+async def _stream_json_array(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    """Encode batches of rows as one JSON array, one chunk per batch."""
+    yield b"["
+    separator = b""
+    async for batch in batches:
+        if batch:
+            # orjson encodes the whole batch in C; strip its brackets to splice it in
+            yield separator + orjson.dumps(batch)[1:-1]
+            separator = b","
+    yield b"]"
+
 @router.get("/floats", response_model=List[schemas.FloatMetadata], tags=["Floats"])
-def get_all_floats(db: Session = Depends(get_db)):
+async def get_all_floats():
     """
     Fetch all floats and their latest known position for the map.
+    The response is streamed, so the first floats are sent before the
+    query has finished.
     """
     # <-- CHANGED: No longer takes a 'region' parameter.
-    floats = langchain_services.fetch_all_floats(db=db)
-    return floats
+    return StreamingResponse(
+        _stream_json_array(langchain_services.stream_all_floats()),
+        media_type="application/json"
+    )
 
-@router.get("/float/{float_id}/profiles", response_model=List[schemas.ProfileData], tags=["Floats"])
+@router.get("/float/{float_id}/profiles", response_model=schemas.ProfilePage, tags=["Floats"])
 # <-- CHANGED: Path is now /profiles, float_id is a string, and accepts an optional 'variable' filter.
-def get_float_profiles(float_id: str, variable: Optional[str] = None, db: Session = Depends(get_db)):
+async def get_float_profiles(
+    float_id: str,
+    variable: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    after: Optional[datetime] = None,
+    after_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
     """
-    Fetch time-series profile data for a single float.
+    Fetch one page of time-series profile data for a single float.
     Can be filtered by variable_name (e.g., 'TEMP' or 'PSAL').
-    Example: /api/float/some_id/profiles?variable=TEMP
+    Example: /api/float/some_id/profiles?variable=TEMP&limit=500
+
+    To fetch the next page, pass the returned `next_cursor` back as
+    `after` and `after_id`. `next_cursor` is null on the last page.
     """
-    # <-- CHANGED: Calls the new service function.
-    profiles = langchain_services.fetch_float_profiles(db, float_id=float_id, variable=variable)
-    if not profiles:
+    profiles = await langchain_services.fetch_float_profiles(
+        db, float_id=float_id, variable=variable,
+        limit=limit, after=after, after_id=after_id
+    )
+    if not profiles and after is None:
         raise HTTPException(status_code=404, detail="Profile data not found for this float")
-    return profiles
+
+    next_cursor = None
+    if len(profiles) == limit:
+        last = profiles[-1]
+        next_cursor = {"after": last["profile_time"], "after_id": last["profile_id"]}
+
+    return ORJSONResponse({
+        "items": [dict(row) for row in profiles],
+        "next_cursor": next_cursor
+    })
 
 @router.post("/query", tags=["Query"])
-def query_floats(query: schemas.NLQuery):
+async def query_floats(query: schemas.NLQuery):
+    """
+    Send a natural language query to the LangChain service.
+    """
+    if langchain_services.NL_QUERY_BATCHING:
+        return await langchain_services.nl_query_batcher.submit(query.text)
+    return await langchain_services.handle_natural_language_query_async(query.text)
+
+@router.post("/query/batch", tags=["Query"])
+async def query_floats_batch(query: schemas.NLQueryBatch):
+    """
+    Send several natural language queries, answered in a single agent run.
+    """
+    return await langchain_services.handle_natural_language_query_batch(query.texts)
+
+@router.post("/query/stream", tags=["Query"])
+async def stream_query_floats(query: schemas.NLQuery):
     """
-    Send a natural language query to the LangChain service. (Unchanged)
+    Send a natural language query and stream the answer text as it is generated.
     """
-    return langchain_services.handle_natural_language_query(query.text)
\ No newline at end of file
+    return StreamingResponse(
+        langchain_services.stream_natural_language_query(query.text),
+        media_type="text/plain; charset=utf-8"
+    )
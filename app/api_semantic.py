@@ -4,18 +4,22 @@ FastAPI routes for semantic search functionality with optimized query routing.
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
+import asyncio
+import hashlib
 import logging
 
 from . import schemas
 from .database import get_db
 from .services.semantic_service import (
-    insert_metadata_batch,
     semantic_search,
     metadata_filter_search,
     get_vector_status
 )
 from .services.query_optimizer import query_optimizer
 from .services.dual_storage import dual_storage
+from .services.semantic_cache import search_cache
+from .services.embedding_batcher import embedding_batcher
+from .services.ingest_queue import ingest_queue
 
 logger = logging.getLogger(__name__)
 
@@ -24,9 +28,10 @@ router = APIRouter(prefix="/api/semantic", tags=["Semantic Search & Optimization
 # === Legacy Embedding Endpoint (for backward compatibility) ===
 
 @router.post("/embed", response_model=schemas.EmbedResponse)
-def embed_metadata_batch_route(request: schemas.EmbedRequest):
+async def embed_metadata_batch_route(request: schemas.EmbedRequest):
     """
-    Generate embeddings for a batch of float metadata and insert into vector database only.
+    Queue a batch of float metadata for embedding and insertion into the vector database only.
+    The batch is processed in the background; poll /embed/status/{job_id} for the outcome.
     
     NOTE: For new implementations, use /ingest/batch instead as it stores data in both databases.
     
@@ -34,20 +39,41 @@ def embed_metadata_batch_route(request: schemas.EmbedRequest):
         request: EmbedRequest containing list of metadata dictionaries
         
     Returns:
-        EmbedResponse with insertion status and counts
+        EmbedResponse with status "queued" and the job ID
     """
     try:
-        result = insert_metadata_batch(request.metadatas)
+        job_id = await ingest_queue.submit(request.metadatas)
         
-        if result["status"] == "error":
-            raise HTTPException(status_code=500, detail=result["message"])
-        
-        return schemas.EmbedResponse(**result)
+        return schemas.EmbedResponse(
+            status="queued",
+            job_id=job_id,
+            count=len(request.metadatas),
+            message=f"Queued {len(request.metadatas)} entries"
+        )
         
     except Exception as e:
         logger.error(f"Embed route error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/embed/status/{job_id}", response_model=schemas.EmbedResponse)
+def embed_status_route(job_id: str):
+    """
+    Get the status of a queued /embed job.
+    Job statuses are kept in the memory of the worker process that accepted
+    the job, so with several workers polling only works when it reaches
+    that same worker; other workers answer 404.
+    
+    Args:
+        job_id: Job ID returned by /embed
+        
+    Returns:
+        EmbedResponse with status queued, running, done or error
+    """
+    status = ingest_queue.get_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown embed job: {job_id}")
+    return schemas.EmbedResponse(**status)
+
 # === Optimized Query Endpoints ===
 
 @router.post("/query/optimized")
@@ -77,7 +103,18 @@ async def optimized_query_route(
     - 'concurrent': Run both SQL and vector queries simultaneously
     """
     try:
+        # Literal repeats (e.g. dashboard polling) skip classification and embedding
+        cache_key = hashlib.blake2b(
+            f"{request.strategy}|{request.query}".encode(), digest_size=16
+        ).hexdigest()
+        cached = query_optimizer.response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         result = await query_optimizer.optimize_query(request.query, db, request.strategy)
+        
+        if result.get("status") == "success":
+            query_optimizer.response_cache[cache_key] = result
         return result
         
     except Exception as e:
@@ -85,9 +122,10 @@ async def optimized_query_route(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/search", response_model=schemas.SemanticSearchResponse)
-def semantic_search_route(request: schemas.SemanticSearchRequest):
+async def semantic_search_route(request: schemas.SemanticSearchRequest):
     """
     Perform semantic search on float metadata using vector similarity.
+    Query embeddings of concurrent searches are computed in shared batches.
     
     Args:
         request: SemanticSearchRequest with query and top_k
@@ -96,10 +134,25 @@ def semantic_search_route(request: schemas.SemanticSearchRequest):
         SemanticSearchResponse with ranked results
     """
     try:
-        result = semantic_search(request.query, request.top_k)
+        # Exact repeats (memory or Redis) are answered before embedding the
+        # query; paraphrased repeats from the similarity tier after
+        scope = f"top_k={request.top_k}"
+        result = await asyncio.to_thread(search_cache.lookup_exact, request.query, scope)
+        if result is None:
+            query_embedding = await embedding_batcher.submit(request.query)
+            result, _ = await asyncio.to_thread(
+                search_cache.lookup_similar, request.query, scope, query_embedding
+            )
         
-        if result["status"] == "error":
-            raise HTTPException(status_code=500, detail=result["message"])
+        if result is None:
+            result = await asyncio.to_thread(
+                semantic_search, request.query, request.top_k, query_embedding=query_embedding
+            )
+            
+            if result["status"] == "error":
+                raise HTTPException(status_code=500, detail=result["message"])
+            
+            await asyncio.to_thread(search_cache.store, request.query, result, query_embedding, scope=scope)
         
         # Convert to Pydantic models
         search_results = []
@@ -118,7 +171,7 @@ def semantic_search_route(request: schemas.SemanticSearchRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/search/filter")
-def metadata_filter_search_route(
+async def metadata_filter_search_route(
     where_filter: Dict[str, Any],
     limit: int = 10
 ):
@@ -141,7 +194,7 @@ def metadata_filter_search_route(
     ```
     """
     try:
-        result = metadata_filter_search(where_filter, limit)
+        result = await asyncio.to_thread(metadata_filter_search, where_filter, limit)
         
         if result["status"] == "error":
             raise HTTPException(status_code=500, detail=result["message"])
@@ -155,7 +208,7 @@ def metadata_filter_search_route(
 # === Legacy RAG Endpoint ===
 
 @router.post("/rag_query", response_model=schemas.RAGQueryResponse)
-def rag_query_route(request: schemas.RAGQueryRequest):
+async def rag_query_route(request: schemas.RAGQueryRequest):
     """
     Legacy hybrid RAG query endpoint.
     
@@ -170,7 +223,7 @@ def rag_query_route(request: schemas.RAGQueryRequest):
     try:
         # Use simplified hybrid query from semantic_service
         from .services.semantic_service import hybrid_rag_query
-        result = hybrid_rag_query(request.query, request.top_k)
+        result = await asyncio.to_thread(hybrid_rag_query, request.query, request.top_k)
         
         if result["status"] == "error":
             raise HTTPException(status_code=500, detail=result["message"])
@@ -212,15 +265,18 @@ def vector_status_route():
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/status/storage")
-def storage_status_route():
+def storage_status_route(exact: bool = False, db: Session = Depends(get_db)):
     """
     Get comprehensive status of both SQL and Vector storage systems.
     
+    Args:
+        exact: Count SQL rows exactly instead of using planner estimates
+        
     Returns:
         Dictionary with storage statistics and sync status
     """
     try:
-        return dual_storage.get_storage_stats()
+        return dual_storage.get_storage_stats(db, exact=exact)
         
     except Exception as e:
         logger.error(f"Storage status error: {e}")
@@ -269,6 +325,8 @@ async def sync_databases_route(db: Session = Depends(get_db)):
     """
     try:
         result = await dual_storage.sync_databases(db)
+        if result.get("synced_count"):
+            await query_optimizer.invalidate_caches()
         
         if result["status"] == "error":
             raise HTTPException(status_code=500, detail=result["message"])
@@ -279,6 +337,61 @@ async def sync_databases_route(db: Session = Depends(get_db)):
         logger.error(f"Database sync error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/maintenance/backfill")
+async def bulk_backfill_route(batch_mode: bool = True, db: Session = Depends(get_db)):
+    """
+    Embed all floats missing from the vector database.
+    
+    Args:
+        batch_mode: Submit OpenAI Batch API jobs (cheaper, asynchronous) instead
+            of embedding synchronously
+        
+    Returns:
+        Dictionary with the submitted batch IDs, or sync results
+    """
+    try:
+        result = await dual_storage.bulk_backfill(db, batch_mode=batch_mode)
+        if result.get("synced_count"):
+            await query_optimizer.invalidate_caches()
+        
+        if result["status"] == "error":
+            raise HTTPException(status_code=500, detail=result["message"])
+        
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Bulk backfill error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/maintenance/backfill/{batch_id}")
+async def complete_bulk_backfill_route(batch_id: str, db: Session = Depends(get_db)):
+    """
+    Store the vectors of a finished backfill batch job.
+    
+    Args:
+        batch_id: Batch job ID returned by /maintenance/backfill
+        
+    Returns:
+        Dictionary with the batch status and stored vector count
+    """
+    try:
+        result = await dual_storage.complete_bulk_backfill(db, batch_id)
+        if result.get("synced_count"):
+            await query_optimizer.invalidate_caches()
+        
+        if result["status"] == "error":
+            raise HTTPException(status_code=500, detail=result["message"])
+        
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Bulk backfill completion error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/maintenance/reset_stats")
 def reset_performance_stats():
     """
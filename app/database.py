@@ -1,4 +1,4 @@
-# argo-backend/app/database.py
+# app/database.py
 
 import os
 from sqlalchemy import create_engine
@@ -17,8 +17,28 @@ DB_NAME = os.getenv("SUPABASE_DB_NAME")
 
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-# Create the SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+# Connection pool configuration, shared with app.database_async
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+# Recycle before Supabase/PgBouncer drops idle connections
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Rows per multi-row INSERT when an executemany is batched into VALUES pages
+DB_INSERT_PAGE_SIZE = int(os.getenv("DB_INSERT_PAGE_SIZE", "1000"))
+
+# Create the SQLAlchemy engine. pre_ping replaces connections the server
+# closed while idle; LIFO reuses the most recently used (warm) connections.
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_use_lifo=True,
+    # executemany INSERTs go out as multi-row VALUES pages, other
+    # executemany statements through psycopg2's execute_batch
+    executemany_mode="values_plus_batch",
+    insertmanyvalues_page_size=DB_INSERT_PAGE_SIZE
+)
 
 # Create a configured "Session" class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -0,0 +1,31 @@
+# app/database_async.py
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from .database import (
+    DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_INSERT_PAGE_SIZE
+)
+
+# Same Supabase database as app.database, reached through the asyncpg driver
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Create the async SQLAlchemy engine. Handlers release their connection back
+# to the pool while awaiting, so the pool is sized for concurrent requests.
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_use_lifo=True,
+    insertmanyvalues_page_size=DB_INSERT_PAGE_SIZE
+)
+
+# Create a configured "AsyncSession" class
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+# Dependency to get an async DB session for each request
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
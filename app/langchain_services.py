@@ -1,8 +1,15 @@
-# app/services.py
+# app/langchain_services.py
 
-from sqlalchemy.orm import Session, aliased
-from sqlalchemy import func
-from typing import Optional, List
+import asyncio
+import logging
+import os
+import time
+from functools import lru_cache
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, text, tuple_
+from typing import Any, Optional, List, Dict, Tuple, AsyncIterator
+from datetime import datetime
 from . import models
 
 # (Keep the LangChain imports and agent initialization as they were)
@@ -10,112 +17,189 @@ from langchain_openai import ChatOpenAI
 from langchain_community.agent_toolkits import create_sql_agent
 from langchain_community.utilities.sql_database import SQLDatabase
 from .database import engine
+from .database_async import AsyncSessionLocal
+from .services.micro_batcher import MicroBatcher
+from .services.semantic_cache import CACHE_TTL_SECONDS, get_redis_client, nl_query_cache
 
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-db = SQLDatabase(engine, include_tables=['floats', 'profiles'])
-sql_agent_executor = create_sql_agent(llm, db=db, agent_type="openai-tools", verbose=True)
+logger = logging.getLogger(__name__)
 
+# Print the agent's intermediate thoughts and tool calls (debugging only)
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "0") == "1"
+# Coalesce concurrent /query requests into one batched agent run
+NL_QUERY_BATCHING = os.getenv("NL_QUERY_BATCHING", "0") == "1"
+NL_BATCH_WINDOW_SECONDS = float(os.getenv("NL_BATCH_WINDOW_MS", "50")) / 1000
+NL_BATCH_MAX_SIZE = int(os.getenv("NL_BATCH_MAX_SIZE", "8"))
+# Seconds to wait before retrying a failed schema card lookup
+SCHEMA_CARD_RETRY_SECONDS = float(os.getenv("SCHEMA_CARD_RETRY_SECONDS", "60"))
 
-def fetch_all_floats(db: Session) -> List[dict]:
+class CachedSQLDatabase(SQLDatabase):
     """
-    Fetches all floats and their latest known position.
-    This is now a more complex query to get the last profile for each float.
+    SQLDatabase that renders each table_info string once per process.
+    The agent's schema tool otherwise re-reflects the tables (and would
+    re-sample rows) on every call; the schema only changes with a deploy.
     """
-    print("SERVICE: Fetching all floats and their latest positions...")
 
-    # Create a subquery to find the latest profile_time for each float
-    latest_profile_sq = db.query(
-        models.Profile.float_id,
-        func.max(models.Profile.profile_time).label("max_time")
-    ).group_by(models.Profile.float_id).subquery()
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._table_info_cache: Dict[Tuple[str, ...], str] = {}
 
-    # Main query to join floats with their latest profile
-    results = db.query(
-        models.Float,
-        models.Profile.lat,
-        models.Profile.lon
-    ).join(
-        latest_profile_sq,
-        models.Float.float_id == latest_profile_sq.c.float_id
+    def get_table_info(self, table_names: Optional[List[str]] = None) -> str:
+        key = tuple(sorted(table_names)) if table_names else ()
+        if key not in self._table_info_cache:
+            self._table_info_cache[key] = super().get_table_info(table_names)
+        return self._table_info_cache[key]
+
+# gpt-4o-mini handles the SQL agent's tool calls at a fraction of the latency
+# and cost of the larger models
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+
+# The LLM, SQLDatabase and agent are built on the first NL query rather than
+# at import, so workers that only serve /floats never reflect the schema or
+# create the OpenAI client.
+
+@lru_cache(maxsize=1)
+def get_llm() -> ChatOpenAI:
+    """Returns the process-wide chat model for the SQL agent."""
+    # With Redis configured, also cache individual LLM calls so agent runs that
+    # share intermediate steps (e.g. the same generated SQL) skip those round-trips
+    if get_redis_client() is not None:
+        from langchain.globals import set_llm_cache
+        from langchain_community.cache import RedisCache
+        set_llm_cache(RedisCache(redis_=get_redis_client(), ttl=int(CACHE_TTL_SECONDS)))
+
+    return ChatOpenAI(model=LLM_MODEL, temperature=0, streaming=True, request_timeout=30)
+
+@lru_cache(maxsize=1)
+def get_sql_database() -> CachedSQLDatabase:
+    """Returns the process-wide SQLDatabase the agent queries."""
+    # Only the two tables the prompt describes; no sample rows, since the prompt
+    # already documents the columns and the samples just cost tokens and a SELECT.
+    return CachedSQLDatabase(
+        engine,
+        include_tables=['floats', 'profiles'],
+        sample_rows_in_table_info=0,
+        view_support=False
+    )
+
+@lru_cache(maxsize=1)
+def get_sql_agent():
+    """Returns the process-wide LangChain SQL agent executor."""
+    return create_sql_agent(get_llm(), db=get_sql_database(), agent_type="openai-tools",
+                            verbose=AGENT_VERBOSE)
+
+
+def _latest_positions_stmt():
+    """
+    Builds the select for every float's latest known position.
+    The latest position per float is precomputed in the
+    latest_profile_per_float materialized view.
+    """
+    return select(
+        models.Float.float_id,
+        models.Float.platform_number,
+        models.LatestProfile.lat,
+        models.LatestProfile.lon
     ).join(
-        models.Profile,
-        (models.Float.float_id == models.Profile.float_id) &
-        (models.Profile.profile_time == latest_profile_sq.c.max_time)
-    ).all()
-
-    # Format the response to match the FloatMetadata schema
-    floats_with_location = []
-    for float_obj, lat, lon in results:
-        floats_with_location.append({
-            "float_id": float_obj.float_id,
-            "platform_number": float_obj.platform_number,
-            "lat": lat,
-            "lon": lon
-        })
-    return floats_with_location
-
-def fetch_float_profiles(db: Session, float_id: str, variable: Optional[str] = None):
-    """
-    Fetches all profiles for a specific float.
-    Optionally filters by a variable name (e.g., 'TEMP' or 'PSAL').
+        models.LatestProfile,
+        models.Float.float_id == models.LatestProfile.float_id
+    )
+
+async def fetch_all_floats(db: AsyncSession) -> List[dict]:
     """
-    print(f"SERVICE: Fetching profiles for float_id: {float_id}, variable: {variable}")
-    
-    query = db.query(models.Profile).filter(models.Profile.float_id == float_id)
+    Fetches all floats and their latest known position.
+    """
+    logger.debug("Fetching all floats and their latest positions...")
 
-    if variable:
-        query = query.filter(models.Profile.variable_name == variable.upper())
-        
-    return query.order_by(models.Profile.profile_time.asc()).all()
+    # Row mappings already carry the FloatMetadata field names
+    result = await db.execute(_latest_positions_stmt())
+    return [dict(row) for row in result.mappings().all()]
 
-def handle_natural_language_query(query_text: str):
+async def stream_all_floats(batch_size: int = 1000) -> AsyncIterator[List[dict]]:
     """
-    The LangChain agent will automatically adapt to the new schema,
-    but the queries it generates will be more complex.
+    Streams all floats and their latest known position in batches.
+    Rows come from a server-side cursor, so memory stays bounded by
+    batch_size regardless of the number of floats. Opens its own session
+    because the stream outlives the request handler.
     """
-    print(f"SERVICE: Processing NL query: '{query_text}' with LangChain...")
+    logger.debug("Streaming all floats and their latest positions...")
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(_latest_positions_stmt().execution_options(yield_per=batch_size))
+        async for partition in result.mappings().partitions(batch_size):
+            yield [dict(row) for row in partition]
+
+async def fetch_float_profiles(db: AsyncSession, float_id: str, variable: Optional[str] = None,
+                               limit: int = 500, after: Optional[datetime] = None,
+                               after_id: Optional[str] = None):
+    """
+    Fetches one page of profiles for a specific float.
+    Optionally filters by a variable name (e.g., 'TEMP' or 'PSAL').
+
+    Pages are keyset-paginated on (profile_time, profile_id): pass the last
+    row's values as `after` / `after_id` to get the next page. profile_id is
+    the tie-breaker because every variable/level of a profile shares its time.
+    """
+    logger.debug(f"Fetching profiles for float_id: {float_id}, variable: {variable}, after: {after}")
     
-# In app/services.py
+    # Select only the ProfileData columns; Core rows skip identity-map
+    # bookkeeping and attribute instrumentation entirely.
+    stmt = select(
+        models.Profile.profile_id,
+        models.Profile.profile_time,
+        models.Profile.variable_name,
+        models.Profile.variable_value,
+        models.Profile.depth
+    ).where(models.Profile.float_id == float_id)
 
-# ... inside the handle_natural_language_query function ...
-    # In app/services.py -> handle_natural_language_query()
+    if variable:
+        stmt = stmt.where(models.Profile.variable_name == variable.upper())
+
+    if after is not None:
+        if after_id is not None:
+            stmt = stmt.where(
+                tuple_(models.Profile.profile_time, models.Profile.profile_id) > (after, after_id)
+            )
+        else:
+            stmt = stmt.where(models.Profile.profile_time > after)
+        
+    stmt = stmt.order_by(
+        models.Profile.profile_time.asc(),
+        models.Profile.profile_id.asc()
+    ).limit(limit)
 
-    prompt = f"""
+    result = await db.execute(stmt)
+    return result.mappings().all()
+
+# Prompt template for the SQL agent. The schema is spelled out (including the
+# JSONB keys, see get_schema_card) so the agent can write the final query
+# directly instead of spending an LLM round-trip and a SELECT exploring it.
+NL_PROMPT_TEMPLATE = """
     You are an expert data analyst querying a database of oceanographic ARGO float data.
     Your task is to answer the user's question by generating a final response in a specific JSON format.
 
     ---
     ## Schema Description:
 
-    ### `floats` table (MAIN DATA SOURCE):
-    - Contains ALL oceanographic data in the `properties` JSONB column
+    ### `profiles` table (MEASUREMENTS):
+    - One row per float / profile time / variable / level
+    - Typed columns: `profile_id`, `float_id`, `profile_time`, `lat`, `lon`, `depth`, `level`,
+      `pressure`, `temperature`, `salinity`, `variable_name`, `variable_value`
+    - `temperature` (°C), `salinity` (PSU) and `pressure` (dbar) are plain DOUBLE PRECISION
+      columns; query them directly, e.g. `AVG(temperature)`, `WHERE salinity > 35`
+    - `variable_name` is 'TEMP', 'PSAL', ... with the reading in `variable_value`
+    - Indexed on (`float_id`, `profile_time`) and (`float_id`, `variable_name`, `profile_time`)
+
+    ### `floats` table (FLOAT METADATA):
     - Fields: `float_id`, `platform_number`, `deploy_date`, `properties` (JSONB)
-    - The `properties` column contains all measurements and metadata
-
-    ## CRITICAL: First Explore the JSON Structure
-    Before writing complex queries, ALWAYS first run:
-    ```sql
-    SELECT float_id, properties FROM floats LIMIT 5;
-    ```
-    This will show you the actual JSON structure in the properties column.
-
-    ## JSON Query Patterns:
-    Based on the actual structure you find, use these patterns:
-    - Extract top-level values: `properties->>'field_name'`
-    - Extract nested values: `properties->'parent'->'child'->>'field'`
-    - Check if key exists: `properties ? 'field_name'`
-    - Get all keys: `jsonb_object_keys(properties)`
+    - `properties` only holds extra, deployment-specific metadata; it has a GIN index,
+      so prefer containment filters like `properties @> '{{"key": "value"}}'`
+    - Known `properties` keys: {schema_card}
 
     ## Query Strategy:
-    1. **FIRST**: Explore the JSON structure with a simple SELECT
-    2. **THEN**: Write the appropriate JSONB query based on what you find
-    3. **Focus on actual data**: Don't assume field names, discover them
-
-    ## Common ARGO Float Data Fields (check what exists):
-    - Temperature data might be in: `measurements`, `temp`, `temperature`, `TEMP`
-    - Location might be in: `location`, `coordinates`, `lat`, `lon`, `latitude`, `longitude`
-    - Pressure/depth: `pressure`, `depth`, `PRES`
-    - Salinity: `salinity`, `salt`, `PSAL`
+    1. Use the typed `profiles` columns for all measurements and positions
+    2. Only touch `floats.properties` for metadata that is not a column
+    3. If you need `properties`, extract values with `properties->>'field_name'`
+    4. The schema above is complete; do not run exploratory queries to discover it
 
     ---
     ## Final Output Instructions:
@@ -129,8 +213,195 @@ def handle_natural_language_query(query_text: str):
     ## User Question:
     {query_text}
     """
+
+_schema_card: Optional[str] = None
+_schema_card_failed_at = 0.0
+
+def get_schema_card() -> str:
+    """
+    Lists the top-level keys found in floats.properties.
+    The JSONB layout is fixed per deployment, so a successful lookup is
+    cached for the life of the process. It runs a blocking query, so it is
+    built by the startup warmup; async callers go through asyncio.to_thread.
+    A failed lookup is not retried for SCHEMA_CARD_RETRY_SECONDS.
+    """
+    global _schema_card, _schema_card_failed_at
+    if _schema_card is not None:
+        return _schema_card
+    if time.monotonic() - _schema_card_failed_at < SCHEMA_CARD_RETRY_SECONDS:
+        return "unknown"
+
+    try:
+        with engine.connect() as conn:
+            keys = conn.execute(text(
+                "SELECT DISTINCT jsonb_object_keys(properties) AS key "
+                "FROM (SELECT properties FROM floats "
+                "WHERE jsonb_typeof(properties) = 'object' LIMIT 1000) AS sample "
+                "ORDER BY key"
+            )).scalars().all()
+    except Exception as e:
+        logger.warning(f"Could not build schema card: {e}")
+        _schema_card_failed_at = time.monotonic()
+        return "unknown"
+
+    _schema_card = ", ".join(f"`{key}`" for key in keys) if keys else "none"
+    return _schema_card
+
+def _build_nl_prompt(query_text: str) -> str:
+    """Builds the agent prompt for a natural language question."""
+    return NL_PROMPT_TEMPLATE.format(schema_card=get_schema_card(), query_text=query_text)
+
+def _build_nl_batch_prompt(query_texts: List[str]) -> str:
+    """
+    Builds one agent prompt for several questions, so the schema and
+    instructions are sent once instead of once per question.
+    """
+    questions = "\n".join(f"[Q{i}] {text}" for i, text in enumerate(query_texts, 1))
+    batch_text = (
+        f"There are {len(query_texts)} questions below. Answer each one independently.\n"
+        f"Your final answer MUST be a JSON array of exactly {len(query_texts)} objects in the "
+        f"format described above, one per question, in the same order.\n\n{questions}"
+    )
+    return _build_nl_prompt(batch_text)
+
+def _parse_nl_batch_output(output: str, count: int) -> Optional[List[Any]]:
+    """Extracts the per-question answers from a batched agent output."""
+    try:
+        answers = orjson.loads(output[output.index("["):output.rindex("]") + 1])
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(answers, list) or len(answers) != count:
+        return None
+    return answers
+
+def handle_natural_language_query(query_text: str):
+    """
+    The LangChain agent will automatically adapt to the new schema,
+    but the queries it generates will be more complex.
+    """
+    logger.debug(f"Processing NL query: '{query_text}' with LangChain...")
+
+    cached, embedding = nl_query_cache.lookup(query_text)
+    if cached is not None:
+        return cached
+
+    prompt = _build_nl_prompt(query_text)
     try:
-        result = sql_agent_executor.invoke({"input": prompt})
-        return {"query": query_text, "response": result.get("output")}
+        result = get_sql_agent().invoke({"input": prompt})
+        response = {"query": query_text, "response": result.get("output")}
     except Exception as e:
-        return {"error": f"An error occurred with the LangChain agent: {e}"}
\ No newline at end of file
+        return {"error": f"An error occurred with the LangChain agent: {e}"}
+
+    nl_query_cache.store(query_text, response, embedding)
+    return response
+
+async def handle_natural_language_query_async(query_text: str):
+    """
+    Async variant of handle_natural_language_query.
+    Awaits the agent with ainvoke so concurrent requests overlap their LLM
+    and database waits instead of blocking the event loop.
+    """
+    logger.debug(f"Processing NL query (async): '{query_text}' with LangChain...")
+
+    # The cache embeds the query synchronously, so keep it off the event loop
+    cached, embedding = await asyncio.to_thread(nl_query_cache.lookup, query_text)
+    if cached is not None:
+        return cached
+
+    prompt = await asyncio.to_thread(_build_nl_prompt, query_text)
+    try:
+        result = await get_sql_agent().ainvoke({"input": prompt})
+        response = {"query": query_text, "response": result.get("output")}
+    except Exception as e:
+        return {"error": f"An error occurred with the LangChain agent: {e}"}
+
+    await asyncio.to_thread(nl_query_cache.store, query_text, response, embedding)
+    return response
+
+async def stream_natural_language_query(query_text: str) -> AsyncIterator[str]:
+    """
+    Streaming variant of handle_natural_language_query_async.
+    Yields the agent's answer text as the LLM produces it, so the client
+    sees the first tokens without waiting for the whole agent run.
+    """
+    logger.debug(f"Streaming NL query: '{query_text}' with LangChain...")
+
+    cached, embedding = await asyncio.to_thread(nl_query_cache.lookup, query_text)
+    if cached is not None:
+        yield cached.get("response") or ""
+        return
+
+    prompt = await asyncio.to_thread(_build_nl_prompt, query_text)
+    streamed = []
+    output = None
+    try:
+        async for event in get_sql_agent().astream_events({"input": prompt}, version="v2"):
+            if event["event"] == "on_chat_model_stream":
+                content = event["data"]["chunk"].content
+                if content:
+                    streamed.append(content)
+                    yield content
+            elif event["event"] == "on_chain_end" and not event.get("parent_ids"):
+                # The top-level agent run carries the final answer
+                output = (event["data"].get("output") or {}).get("output")
+    except Exception as e:
+        yield f"An error occurred with the LangChain agent: {e}"
+        return
+
+    response = {"query": query_text, "response": output if output is not None else "".join(streamed)}
+    await asyncio.to_thread(nl_query_cache.store, query_text, response, embedding)
+
+async def handle_natural_language_query_batch(query_texts: List[str]) -> List[dict]:
+    """
+    Answers several natural language questions with a single agent run.
+    Cached questions are answered from the cache; the rest share one prompt.
+    If the agent's output cannot be split into one answer per question,
+    each question falls back to its own run.
+    """
+    logger.debug(f"Processing {len(query_texts)} NL queries as one batch with LangChain...")
+
+    lookups = await asyncio.gather(
+        *[asyncio.to_thread(nl_query_cache.lookup, text) for text in query_texts]
+    )
+    results: List[Optional[dict]] = [cached for cached, _ in lookups]
+    pending = [i for i, cached in enumerate(results) if cached is None]
+    if not pending:
+        return results
+    if len(pending) == 1:
+        results[pending[0]] = await handle_natural_language_query_async(query_texts[pending[0]])
+        return results
+
+    prompt = await asyncio.to_thread(_build_nl_batch_prompt, [query_texts[i] for i in pending])
+    try:
+        result = await get_sql_agent().ainvoke({"input": prompt})
+        answers = _parse_nl_batch_output(result.get("output") or "", len(pending))
+    except Exception as e:
+        logger.warning(f"Batched NL query failed, answering individually: {e}")
+        answers = None
+
+    if answers is None:
+        individual = await asyncio.gather(
+            *[handle_natural_language_query_async(query_texts[i]) for i in pending]
+        )
+        for i, response in zip(pending, individual):
+            results[i] = response
+        return results
+
+    for i, answer in zip(pending, answers):
+        response = {"query": query_texts[i], "response": orjson.dumps(answer, default=str).decode()}
+        results[i] = response
+        await asyncio.to_thread(nl_query_cache.store, query_texts[i], response, lookups[i][1])
+    return results
+
+async def _answer_nl_batch(query_texts: List[str]) -> List[dict]:
+    """Batch function for nl_query_batcher; agent failures become error responses."""
+    try:
+        return await handle_natural_language_query_batch(query_texts)
+    except Exception as e:
+        return [{"error": f"An error occurred with the LangChain agent: {e}"} for _ in query_texts]
+
+# Global batcher used by /query when NL_QUERY_BATCHING is enabled; coalesces
+# questions that arrive within a short window into one batched agent run
+nl_query_batcher = MicroBatcher(
+    _answer_nl_batch, NL_BATCH_WINDOW_SECONDS, NL_BATCH_MAX_SIZE, name="NL query"
+)
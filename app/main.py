@@ -2,12 +2,18 @@
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware # <-- 1. IMPORT THIS
+from fastapi.responses import ORJSONResponse
 from . import api, api_semantic
+from .services.vector_db import chroma_db
+from .services.embedding_service import get_openai_client, shutdown_embedding_executor
+from .services.ingest_queue import ingest_queue
+from .langchain_services import get_schema_card
 
 app = FastAPI(
     title="ARGO Float Data API",
     description="API for querying and visualizing ARGO float data via structured endpoints and natural language.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # --- 2. ADD THIS MIDDLEWARE BLOCK ---
@@ -31,6 +37,31 @@ app.include_router(api.router, prefix="/api")
 # Include semantic search routes
 app.include_router(api_semantic.router)
 
+# Pay cold-start costs at boot instead of on the first user request
+@app.on_event("startup")
+def warmup():
+    chroma_db.warmup()
+    get_openai_client()
+    get_schema_card()
+
+# Background worker for /api/semantic/embed jobs
+@app.on_event("startup")
+async def start_ingest_queue():
+    ingest_queue.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_queue():
+    await ingest_queue.stop()
+
+@app.on_event("shutdown")
+def stop_embedding_executor():
+    shutdown_embedding_executor()
+
+# The quantized index is saved in batches; write out the remainder
+@app.on_event("shutdown")
+def flush_vector_db():
+    chroma_db.flush()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome! Go to /docs for the API documentation."}
\ No newline at end of file
@@ -1,6 +1,6 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Index, text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -8,27 +8,52 @@ from .database import Base
 # Renamed from Measurement to Profile to match the new schema
 class Profile(Base):
     __tablename__ = "profiles"
+    __table_args__ = (
+        # Newest-first per float, matching the latest_profile_per_float
+        # DISTINCT ON order; lat/lon are included so its refresh is an
+        # index-only scan. fetch_float_profiles' keyset order reads it backwards.
+        Index("ix_profiles_float_time_desc", "float_id", text("profile_time DESC"),
+              text("profile_id DESC"), postgresql_include=["lat", "lon"]),
+        Index("ix_profiles_float_var_time", "float_id", "variable_name", "profile_time"),
+    )
 
-    profile_id = Column(Text, primary_key=True, index=True)
+    # The primary key is already backed by a unique btree; no extra index=True
+    profile_id = Column(Text, primary_key=True)
     float_id = Column(Text, ForeignKey("floats.float_id"))
     profile_time = Column(DateTime(timezone=True))
     lat = Column(Float)
     lon = Column(Float)
     pressure = Column(Float)
     depth = Column(Float)
+    temperature = Column(Float)
+    salinity = Column(Float)
     variable_name = Column(Text)
     variable_value = Column(Float)
     level = Column(Integer)
-    raw_profile = Column(JSONB)
+    raw_profile = Column(JSONB) # Unknown extras only; known fields are columns above
     
     float = relationship("Float", back_populates="profiles")
 
 class Float(Base):
     __tablename__ = "floats"
+    __table_args__ = (
+        # Containment lookups on the remaining free-form metadata
+        Index("ix_floats_properties_gin", "properties", postgresql_using="gin"),
+    )
 
-    float_id = Column(Text, primary_key=True, index=True)
+    float_id = Column(Text, primary_key=True)
     platform_number = Column(Text)
     deploy_date = Column(DateTime(timezone=True))
     properties = Column(JSONB)
 
-    profiles = relationship("Profile", back_populates="float", cascade="all, delete-orphan")
\ No newline at end of file
+    profiles = relationship("Profile", back_populates="float", cascade="all, delete-orphan")
+
+# Read-only mapping of the latest_profile_per_float materialized view
+# (see migrations/001_latest_profile_per_float.sql). Refreshed after ingestion.
+class LatestProfile(Base):
+    __tablename__ = "latest_profile_per_float"
+
+    float_id = Column(Text, ForeignKey("floats.float_id"), primary_key=True)
+    lat = Column(Float)
+    lon = Column(Float)
+    profile_time = Column(DateTime(timezone=True))
\ No newline at end of file
@@ -8,6 +8,10 @@ from typing import Optional, Any, List, Dict
 class NLQuery(BaseModel):
     text: str
 
+# Schema for several natural language queries answered in one agent run
+class NLQueryBatch(BaseModel):
+    texts: List[str]
+
 # --- Schemas for Semantic Search ---
 
 # Schema for embedding requests
@@ -16,6 +20,7 @@ class EmbedRequest(BaseModel):
 
 class EmbedResponse(BaseModel):
     status: str
+    job_id: Optional[str] = None
     count: Optional[int] = None
     total_vectors: Optional[int] = None
     message: Optional[str] = None
@@ -132,4 +137,14 @@ class ProfileData(BaseModel):
     variable_value: float
     depth: Optional[float] = None
     
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+# Keyset cursor pointing at the last row of a profiles page
+class ProfileCursor(BaseModel):
+    after: datetime
+    after_id: str
+
+# One page of profile data plus the cursor for the next page
+class ProfilePage(BaseModel):
+    items: List[ProfileData]
+    next_cursor: Optional[ProfileCursor] = None
\ No newline at end of file
@@ -3,18 +3,36 @@ Dual storage service that manages data in both Supabase (SQL) and ChromaDB (Vect
 This service ensures data consistency across both storage systems.
 """
 import asyncio
-from typing import List, Dict, Any, Optional, Tuple
+import os
+from typing import List, Dict, Any, AsyncIterator
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import logging
 from datetime import datetime
+from operator import itemgetter
 
-from ..database import get_db
-from .. import models, services
+from .. import models
 from .vector_db import chroma_db
-from .embedding_service import embed_float_metadata_batch
+from .embedding_service import (
+    BATCH_API_MAX_REQUESTS,
+    embed_float_metadata_batch_async,
+    fetch_batch_embeddings,
+    format_float_metadata_for_embedding,
+    submit_batch_embeddings
+)
 
 logger = logging.getLogger(__name__)
 
+# floats columns written by ingestion; itemgetter plucks them from the
+# float metadata dicts in one C call per row
+_FLOAT_ROW_COLUMNS = ("float_id", "platform_number", "deploy_date", "properties")
+_float_row_values = itemgetter(*_FLOAT_ROW_COLUMNS)
+
+# Profile batches at least this large are bulk-loaded with COPY
+PROFILE_COPY_THRESHOLD = int(os.getenv("PROFILE_COPY_THRESHOLD", "5000"))
+
 class DualStorageService:
     """Service for managing data across both SQL and Vector databases."""
     
@@ -22,13 +40,13 @@ class DualStorageService:
         self.vector_db = chroma_db
         
     async def ingest_float_data(self, float_data_batch: List[Dict[str, Any]], 
-                               db: Session) -> Dict[str, Any]:
+                               db: AsyncSession) -> Dict[str, Any]:
         """
         Ingest ARGO float data into both Supabase and ChromaDB simultaneously.
         
         Args:
             float_data_batch: List of float data dictionaries
-            db: SQLAlchemy database session
+            db: Async (asyncpg) database session
             
         Returns:
             Dictionary with ingestion results
@@ -56,27 +74,39 @@ class DualStorageService:
                 }
                 float_metadata.append(float_meta)
                 
-                # Extract profile data if available
-                if "profiles" in float_item:
-                    for profile in float_item["profiles"]:
-                        profile_data.append({
-                            "float_id": float_item.get("float_id"),
-                            "profile_id": profile.get("profile_id"),
-                            "profile_time": profile.get("profile_time"),
-                            "lat": profile.get("lat"),
-                            "lon": profile.get("lon"),
-                            "variable_name": profile.get("variable_name"),
-                            "variable_value": profile.get("variable_value"),
-                            "depth": profile.get("depth")
-                        })
-            
-            # Step 2: Store in SQL database (Supabase)
-            sql_success = await self._store_in_sql(float_metadata, profile_data, db)
+                # Extract profile data if available, already in profiles-row
+                # shape so _store_in_sql can insert it as-is
+                float_id = float_meta["float_id"]
+                for profile in float_item.get("profiles") or ():
+                    variable_name = profile.get("variable_name")
+                    variable_value = profile.get("variable_value")
+                    profile_data.append({
+                        "float_id": float_id,
+                        "profile_id": profile.get("profile_id"),
+                        "profile_time": profile.get("profile_time"),
+                        "lat": profile.get("lat"),
+                        "lon": profile.get("lon"),
+                        "variable_name": variable_name,
+                        "variable_value": variable_value,
+                        "depth": profile.get("depth"),
+                        "pressure": profile.get("pressure"),
+                        "temperature": profile.get(
+                            "temperature", variable_value if variable_name == "TEMP" else None
+                        ),
+                        "salinity": profile.get(
+                            "salinity", variable_value if variable_name == "PSAL" else None
+                        )
+                    })
+            
+            # Step 2: Store in SQL database (Supabase) and Vector database (ChromaDB)
+            # concurrently; both await I/O on the event loop, so the inserts
+            # overlap the embedding requests
+            sql_success, vector_success = await asyncio.gather(
+                self._store_in_sql(float_metadata, profile_data, db),
+                self._store_in_vector(float_metadata)
+            )
             sql_results.append({"status": "success" if sql_success else "error", 
                               "count": len(float_metadata)})
-            
-            # Step 3: Store in Vector database (ChromaDB) 
-            vector_success = await self._store_in_vector(float_metadata)
             vector_results.append({"status": "success" if vector_success else "error",
                                  "count": len(float_metadata)})
             
@@ -93,62 +123,96 @@ class DualStorageService:
             return {"status": "error", "message": str(e)}
     
     async def _store_in_sql(self, float_metadata: List[Dict[str, Any]], 
-                           profile_data: List[Dict[str, Any]], db: Session) -> bool:
-        """Store data in SQL database."""
+                           profile_data: List[Dict[str, Any]], db: AsyncSession) -> bool:
+        """Store data in SQL database over asyncpg."""
         try:
-            # Store float metadata
-            for meta in float_metadata:
-                # Check if float already exists
-                existing_float = db.query(models.Float).filter(
-                    models.Float.float_id == meta["float_id"]
-                ).first()
-                
-                if not existing_float:
-                    float_obj = models.Float(
-                        float_id=meta["float_id"],
-                        platform_number=meta["platform_number"],
-                        deploy_date=meta.get("deploy_date"),
-                        properties=meta.get("properties", {})
-                    )
-                    db.add(float_obj)
-            
-            # Store profile data
-            for profile in profile_data:
-                # Check if profile already exists
-                existing_profile = db.query(models.Profile).filter(
-                    models.Profile.profile_id == profile["profile_id"]
-                ).first()
-                
-                if not existing_profile:
-                    profile_obj = models.Profile(
-                        profile_id=profile["profile_id"],
-                        float_id=profile["float_id"],
-                        profile_time=profile.get("profile_time"),
-                        lat=profile.get("lat"),
-                        lon=profile.get("lon"),
-                        variable_name=profile.get("variable_name"),
-                        variable_value=profile.get("variable_value"),
-                        depth=profile.get("depth")
-                    )
-                    db.add(profile_obj)
+            # Store float metadata; existing floats are skipped by the database
+            float_rows = [
+                dict(zip(_FLOAT_ROW_COLUMNS, _float_row_values(meta)))
+                for meta in float_metadata
+            ]
+            await self._insert_ignore_existing(db, models.Float.__table__, float_rows, "float_id")
+            
+            # Store profile data; existing profiles are skipped by the database.
+            # ingest_float_data builds these dicts in row shape, so they are
+            # inserted without another per-row copy. Large batches go through
+            # COPY, which skips per-row SQL parsing and parameter binding.
+            if len(profile_data) >= PROFILE_COPY_THRESHOLD:
+                await self._copy_ignore_existing(db, models.Profile.__table__, profile_data, "profile_id")
+            else:
+                await self._insert_ignore_existing(db, models.Profile.__table__, profile_data, "profile_id")
             
-            db.commit()
+            await db.commit()
             logger.info(f"Successfully stored {len(float_metadata)} floats and {len(profile_data)} profiles in SQL")
             return True
             
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"SQL storage failed: {e}")
             return False
     
+    @staticmethod
+    async def _insert_ignore_existing(db: AsyncSession, table, rows: List[Dict[str, Any]], 
+                                      key: str) -> None:
+        """
+        Insert rows with INSERT ... ON CONFLICT (key) DO NOTHING.
+        The rows are passed as executemany parameters to one cached
+        statement; the engine pages them into multi-row VALUES inserts of
+        DB_INSERT_PAGE_SIZE rows, which keeps each statement under
+        PostgreSQL's bind-parameter limit.
+        """
+        if not rows:
+            return
+        stmt = pg_insert(table).on_conflict_do_nothing(index_elements=[key])
+        await db.execute(stmt, rows)
+    
+    @staticmethod
+    async def _copy_ignore_existing(db: AsyncSession, table, rows: List[Dict[str, Any]], 
+                                    key: str) -> None:
+        """
+        Bulk-load rows with COPY, skipping rows whose key already exists.
+        COPY cannot express ON CONFLICT, so rows are copied into a temporary
+        staging table (emptied on commit) and moved over with one
+        INSERT ... SELECT ... ON CONFLICT (key) DO NOTHING, all inside the
+        session's transaction.
+        """
+        if not rows:
+            return
+        columns = list(rows[0])
+        staging = f"_staging_{table.name}"
+        column_list = ", ".join(columns)
+        
+        connection = await db.connection()
+        raw_connection = (await connection.get_raw_connection()).driver_connection
+        
+        await raw_connection.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+            f"(LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+        await raw_connection.copy_records_to_table(
+            staging,
+            records=[tuple(row[column] for column in columns) for row in rows],
+            columns=columns
+        )
+        await raw_connection.execute(
+            f"INSERT INTO {table.name} ({column_list}) "
+            f"SELECT {column_list} FROM {staging} "
+            f"ON CONFLICT ({key}) DO NOTHING"
+        )
+    
     async def _store_in_vector(self, float_metadata: List[Dict[str, Any]]) -> bool:
         """Store data in vector database."""
         try:
-            # Generate embeddings
-            embeddings = embed_float_metadata_batch(float_metadata)
+            # Floats whose metadata is already stored keep their vectors
+            float_metadata = await asyncio.to_thread(self.vector_db.filter_new_metadatas, float_metadata)
+            if not float_metadata:
+                return True
             
-            # Store in ChromaDB
-            ids = self.vector_db.add_vectors(embeddings, float_metadata)
+            # Generate embeddings; the vector store normalizes them on insert
+            embeddings = await embed_float_metadata_batch_async(float_metadata)
+            
+            # Store in ChromaDB; the upsert and index updates are blocking
+            ids = await asyncio.to_thread(self.vector_db.add_vectors, embeddings, float_metadata)
             
             logger.info(f"Successfully stored {len(ids)} vectors in ChromaDB")
             return True
@@ -157,78 +221,268 @@ class DualStorageService:
             logger.error(f"Vector storage failed: {e}")
             return False
     
-    def get_storage_stats(self) -> Dict[str, Any]:
-        """Get statistics from both storage systems."""
+    async def refresh_latest_profiles(self, db: AsyncSession) -> bool:
+        """
+        Refresh the latest_profile_per_float materialized view after ingestion.
+        CONCURRENTLY keeps /floats readable while the refresh runs.
+        """
         try:
-            # Get database session
-            db = next(get_db())
+            await db.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY latest_profile_per_float"))
+            await db.commit()
+            logger.info("Refreshed latest_profile_per_float")
+            return True
             
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Failed to refresh latest_profile_per_float: {e}")
+            return False
+    
+    def get_storage_stats(self, db: Session, exact: bool = False) -> Dict[str, Any]:
+        """
+        Get statistics from both storage systems.
+        
+        SQL row counts are planner estimates from pg_class.reltuples (kept
+        current by autovacuum/ANALYZE), read in one catalog lookup instead of
+        a full count(*) scan per table.
+        
+        Args:
+            db: Database session
+            exact: Run exact count(*) queries instead of reading the estimates
+            
+        Returns:
+            Dictionary with SQL and vector statistics and sync status
+        """
+        try:
             # SQL stats
-            sql_stats = {
-                "floats_count": db.query(models.Float).count(),
-                "profiles_count": db.query(models.Profile).count()
-            }
+            if exact:
+                sql_stats = {
+                    "floats_count": db.query(models.Float).count(),
+                    "profiles_count": db.query(models.Profile).count(),
+                    "counts": "exact"
+                }
+            else:
+                estimates = dict(db.execute(text(
+                    "SELECT relname, reltuples::bigint FROM pg_class "
+                    "WHERE relname IN ('floats', 'profiles') AND relkind = 'r'"
+                )).all())
+                # reltuples is -1 for tables that have never been analyzed
+                sql_stats = {
+                    "floats_count": max(estimates.get("floats", 0), 0),
+                    "profiles_count": max(estimates.get("profiles", 0), 0),
+                    "counts": "estimated"
+                }
             
             # Vector stats
             vector_stats = self.vector_db.get_collection_info()
             
+            # Estimates drift between ANALYZE runs; allow 1% slack unless exact
+            tolerance = 0 if exact else sql_stats["floats_count"] // 100
+            in_sync = abs(sql_stats["floats_count"] - vector_stats["count"]) <= tolerance
+            
             return {
                 "sql_database": sql_stats,
                 "vector_database": vector_stats,
-                "sync_status": "healthy" if sql_stats["floats_count"] == vector_stats["count"] else "out_of_sync"
+                "sync_status": "healthy" if in_sync else "out_of_sync"
             }
             
         except Exception as e:
             logger.error(f"Failed to get storage stats: {e}")
             return {"error": str(e)}
     
-    async def sync_databases(self, db: Session) -> Dict[str, Any]:
-        """Synchronize data between SQL and Vector databases."""
-        try:
-            # Get all floats from SQL that might not be in vector DB
-            sql_floats = db.query(models.Float).all()
-            
-            # Check which floats are missing in vector DB
-            missing_in_vector = []
-            
-            for float_obj in sql_floats:
-                # Try to find in vector DB by metadata filter
-                results = self.vector_db.search_by_metadata(
-                    where={"float_id": float_obj.float_id},
-                    limit=1
-                )
-                
-                if not results:
-                    # Float not found in vector DB, add it
-                    float_meta = {
-                        "float_id": float_obj.float_id,
-                        "platform_number": float_obj.platform_number,
-                        "deploy_date": str(float_obj.deploy_date) if float_obj.deploy_date else "",
-                        "properties": float_obj.properties or {},
-                        "region": "",  # Would need to be derived or stored separately
-                        "description": "",
-                        "notes": ""
-                    }
-                    missing_in_vector.append(float_meta)
-            
-            # Add missing floats to vector DB
+    @staticmethod
+    def _float_row_to_metadata(row) -> Dict[str, Any]:
+        """Build vector metadata for a float row from SQL."""
+        return {
+            "float_id": row.float_id,
+            "platform_number": row.platform_number,
+            "deploy_date": str(row.deploy_date) if row.deploy_date else "",
+            "properties": row.properties or {},
+            "region": "",  # Would need to be derived or stored separately
+            "description": "",
+            "notes": ""
+        }
+    
+    def _float_metadata_stmt(self, chunk_size: int):
+        """Select only the columns needed for the vector metadata, streamed."""
+        return select(
+            models.Float.float_id,
+            models.Float.platform_number,
+            models.Float.deploy_date,
+            models.Float.properties
+        ).execution_options(stream_results=True, yield_per=chunk_size)
+    
+    async def _iter_missing_in_vector(self, db: Session,
+                                      chunk_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield metadata for SQL floats that have no vector, chunk by chunk.
+        Floats are read through a server-side cursor, so memory stays
+        bounded by chunk_size rather than the table. Each chunk fetch and
+        vector lookup blocks, so they run in worker threads.
+        """
+        partitions = await asyncio.to_thread(
+            lambda: db.execute(self._float_metadata_stmt(chunk_size)).partitions()
+        )
+        while (chunk := await asyncio.to_thread(next, partitions, None)) is not None:
+            # Check which floats are missing in vector DB with one bulk lookup
+            existing_ids = await asyncio.to_thread(
+                self.vector_db.get_existing_float_ids, [row.float_id for row in chunk]
+            )
+            missing_in_vector = [
+                self._float_row_to_metadata(row)
+                for row in chunk
+                if row.float_id not in existing_ids
+            ]
             if missing_in_vector:
-                success = await self._store_in_vector(missing_in_vector)
+                yield missing_in_vector
+    
+    async def sync_databases(self, db: Session, chunk_size: int = 10000) -> Dict[str, Any]:
+        """
+        Synchronize data between SQL and Vector databases.
+        
+        Args:
+            db: Database session
+            chunk_size: Number of floats fetched, checked and embedded per chunk
+            
+        Returns:
+            Dictionary with sync results
+        """
+        try:
+            # Vectors from a previous embedding model are dropped and re-embedded
+            await asyncio.to_thread(self.vector_db.reset_if_stale)
+            synced_count = 0
+            failed_chunks = 0
+            
+            async for missing_in_vector in self._iter_missing_in_vector(db, chunk_size):
+                # Add missing floats to vector DB
+                if await self._store_in_vector(missing_in_vector):
+                    synced_count += len(missing_in_vector)
+                else:
+                    failed_chunks += 1
+            
+            if failed_chunks:
                 return {
-                    "status": "success" if success else "error",
-                    "synced_count": len(missing_in_vector),
-                    "message": f"Synced {len(missing_in_vector)} floats to vector database"
+                    "status": "error",
+                    "synced_count": synced_count,
+                    "message": f"Synced {synced_count} floats to vector database; {failed_chunks} chunks failed"
                 }
-            else:
+            if synced_count:
                 return {
                     "status": "success",
-                    "synced_count": 0,
-                    "message": "Databases are already in sync"
+                    "synced_count": synced_count,
+                    "message": f"Synced {synced_count} floats to vector database"
                 }
+            return {
+                "status": "success",
+                "synced_count": 0,
+                "message": "Databases are already in sync"
+            }
                 
         except Exception as e:
             logger.error(f"Database sync failed: {e}")
             return {"status": "error", "message": str(e)}
+    
+    async def bulk_backfill(self, db: Session, batch_mode: bool = True,
+                            chunk_size: int = 10000) -> Dict[str, Any]:
+        """
+        Embed every SQL float that is missing from the vector database.
+        
+        With batch_mode, the texts are submitted to the OpenAI Batch API
+        (half price, separate rate limits, up to 24h latency) and the vectors
+        are stored later by complete_bulk_backfill. Without it this is
+        sync_databases.
+        
+        Args:
+            db: Database session
+            batch_mode: Submit Batch API jobs instead of embedding synchronously
+            chunk_size: Number of floats fetched and checked per chunk
+            
+        Returns:
+            Dictionary with the submitted batch IDs
+        """
+        if not batch_mode:
+            return await self.sync_databases(db, chunk_size)
+        
+        try:
+            await asyncio.to_thread(self.vector_db.reset_if_stale)
+            batch_ids = []
+            submitted_count = 0
+            pending: Dict[str, str] = {}
+            
+            async for missing_in_vector in self._iter_missing_in_vector(db, chunk_size):
+                for meta in missing_in_vector:
+                    pending[meta["float_id"]] = format_float_metadata_for_embedding(meta)
+                    if len(pending) == BATCH_API_MAX_REQUESTS:
+                        batch_ids.append(await asyncio.to_thread(submit_batch_embeddings, pending))
+                        submitted_count += len(pending)
+                        pending = {}
+            if pending:
+                batch_ids.append(await asyncio.to_thread(submit_batch_embeddings, pending))
+                submitted_count += len(pending)
+            
+            return {
+                "status": "submitted" if batch_ids else "success",
+                "batch_ids": batch_ids,
+                "submitted_count": submitted_count,
+                "message": f"Submitted {submitted_count} floats in {len(batch_ids)} batch jobs"
+                           if batch_ids else "Databases are already in sync"
+            }
+            
+        except Exception as e:
+            logger.error(f"Bulk backfill submission failed: {e}")
+            return {"status": "error", "message": str(e)}
+    
+    async def complete_bulk_backfill(self, db: Session, batch_id: str,
+                                     chunk_size: int = 10000) -> Dict[str, Any]:
+        """
+        Store the vectors of a finished bulk_backfill batch job.
+        
+        Args:
+            db: Database session
+            batch_id: Batch job ID returned by bulk_backfill
+            chunk_size: Number of vectors stored per chunk
+            
+        Returns:
+            Dictionary with the batch status and the number of stored vectors
+        """
+        try:
+            batch_status, embeddings = await asyncio.to_thread(fetch_batch_embeddings, batch_id)
+            if embeddings is None:
+                return {
+                    "status": "pending",
+                    "batch_status": batch_status,
+                    "message": f"Batch {batch_id} is {batch_status}"
+                }
+            
+            stored_count = 0
+            float_ids = list(embeddings)
+            for i in range(0, len(float_ids), chunk_size):
+                chunk_ids = float_ids[i:i + chunk_size]
+                
+                # Skip floats that were synced some other way in the meantime
+                existing_ids = await asyncio.to_thread(self.vector_db.get_existing_float_ids, chunk_ids)
+                rows = db.execute(
+                    self._float_metadata_stmt(chunk_size).where(
+                        models.Float.float_id.in_([fid for fid in chunk_ids if fid not in existing_ids])
+                    )
+                ).all()
+                if not rows:
+                    continue
+                
+                metadatas = [self._float_row_to_metadata(row) for row in rows]
+                vectors = [embeddings[row.float_id] for row in rows]
+                await asyncio.to_thread(self.vector_db.add_vectors, vectors, metadatas)
+                stored_count += len(rows)
+            
+            return {
+                "status": "success",
+                "batch_status": batch_status,
+                "synced_count": stored_count,
+                "message": f"Stored {stored_count} vectors from batch {batch_id}"
+            }
+            
+        except Exception as e:
+            logger.error(f"Bulk backfill completion failed: {e}")
+            return {"status": "error", "message": str(e)}
 
 
 # Global dual storage service instance
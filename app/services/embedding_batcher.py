@@ -0,0 +1,18 @@
+"""
+Cross-request micro-batching of query embeddings.
+Concurrent requests that each need one query embedding share a single
+embeddings API call instead of paying a round-trip apiece.
+"""
+import os
+
+from .embedding_service import get_embeddings_async
+from .micro_batcher import MicroBatcher
+
+# Batching configuration
+EMBED_BATCH_WINDOW_SECONDS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "8")) / 1000
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+
+# Global embedding batcher; submit(text) returns that text's embedding
+embedding_batcher = MicroBatcher(
+    get_embeddings_async, EMBED_BATCH_WINDOW_SECONDS, EMBED_BATCH_MAX_SIZE, name="embedding"
+)
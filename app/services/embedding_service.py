@@ -1,9 +1,17 @@
 """
 OpenAI embedding service for generating vector embeddings from text.
 """
+import asyncio
+import hashlib
 import os
-from openai import OpenAI
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import orjson
+from cachetools import LRUCache
+from functools import lru_cache
+from openai import AsyncOpenAI, OpenAI
+from typing import List, Dict, Any, Optional, Tuple, Union
 import logging
 from tenacity import retry, stop_after_attempt, wait_exponential
 
@@ -14,17 +22,128 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     logger.warning("OPENAI_API_KEY environment variable not set")
 
-# Initialize OpenAI client with new API
-client = OpenAI(api_key=OPENAI_API_KEY)
+@lru_cache(maxsize=1)
+def get_openai_client() -> OpenAI:
+    """Return the process-wide OpenAI client (one connection pool per worker)."""
+    return OpenAI(api_key=OPENAI_API_KEY)
 
-# Embedding model configuration
-EMBEDDING_MODEL = "text-embedding-ada-002"
-EMBEDDING_DIMENSION = 1536
+@lru_cache(maxsize=1)
+def get_async_openai_client() -> AsyncOpenAI:
+    """Return the process-wide async OpenAI client."""
+    return AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+# Embedding model configuration. text-embedding-3 models can return
+# truncated (Matryoshka) vectors; 512 dimensions keeps retrieval quality
+# close to ada-002 at a third of the storage and scoring cost.
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSION = 512
+
+# Inputs per embeddings request; the API rejects more than 2048
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "512"))
+# Maximum number of embeddings requests in flight at once
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+# Requests per Batch API job; the API rejects input files with more
+BATCH_API_MAX_REQUESTS = 50000
+# Embeddings kept in-process, keyed by text hash, for reuse across batches
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+
+_embedding_cache: LRUCache = LRUCache(maxsize=EMBEDDING_CACHE_SIZE)
+_embedding_cache_lock = threading.Lock()
+
+# Threads for the sync path's concurrent chunk requests, shared by all
+# get_embeddings calls so the concurrency cap is process-wide; created on
+# first use and shut down with the app
+_embedding_executor: Optional[ThreadPoolExecutor] = None
+_embedding_executor_lock = threading.Lock()
+
+def _get_embedding_executor() -> ThreadPoolExecutor:
+    """Return the shared embedding thread pool, creating it on first use."""
+    global _embedding_executor
+    with _embedding_executor_lock:
+        if _embedding_executor is None:
+            _embedding_executor = ThreadPoolExecutor(
+                max_workers=EMBEDDING_MAX_CONCURRENCY, thread_name_prefix="embed"
+            )
+        return _embedding_executor
+
+def shutdown_embedding_executor() -> None:
+    """Shut down the shared embedding thread pool, if it was started."""
+    global _embedding_executor
+    with _embedding_executor_lock:
+        if _embedding_executor is not None:
+            _embedding_executor.shutdown(wait=False)
+            _embedding_executor = None
+
+def _text_key(text: str) -> bytes:
+    """Hash a text into an embedding cache key."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+def _lookup_cached_embeddings(texts: List[str]) -> Tuple[List[bytes], Dict[bytes, List[float]], Dict[bytes, str]]:
+    """
+    Resolve texts against the embedding cache.
+    
+    Returns:
+        Tuple (keys, found, missing): one key per input text, cached vectors
+        by key, and the unique uncached texts by key
+    """
+    keys = [_text_key(text) for text in texts]
+    found: Dict[bytes, List[float]] = {}
+    missing: Dict[bytes, str] = {}
+    with _embedding_cache_lock:
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            embedding = _embedding_cache.get(key)
+            if embedding is not None:
+                found[key] = embedding
+            else:
+                missing[key] = text
+    return keys, found, missing
+
+def _cache_embeddings(found: Dict[bytes, List[float]], keys: List[bytes],
+                      embeddings: List[List[float]]) -> None:
+    """Record newly generated embeddings in the cache and in found."""
+    with _embedding_cache_lock:
+        for key, embedding in zip(keys, embeddings):
+            _embedding_cache[key] = embedding
+            found[key] = embedding
+
+def _chunk_texts(texts: List[str]) -> List[List[str]]:
+    """Split texts into request-sized chunks."""
+    return [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+
+def _ordered_embeddings(response) -> List[List[float]]:
+    """Order a response's vectors by index so each lines up with its input text."""
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+def _embed_chunk(texts: List[str]) -> List[List[float]]:
+    """Embed one request-sized chunk, retrying on failure."""
+    response = get_openai_client().embeddings.create(
+        input=texts,
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSION
+    )
+    return _ordered_embeddings(response)
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+async def _embed_chunk_async(texts: List[str]) -> List[List[float]]:
+    """Embed one request-sized chunk with the async client, retrying on failure."""
+    response = await get_async_openai_client().embeddings.create(
+        input=texts,
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSION
+    )
+    return _ordered_embeddings(response)
+
 def get_embeddings(texts: List[str]) -> List[List[float]]:
     """
     Generate embeddings for a list of texts using OpenAI's embedding API.
+    Duplicate and recently embedded texts are served from an in-process
+    cache; the remaining unique texts are sent in chunks of
+    EMBEDDING_BATCH_SIZE, each retried on its own. Chunks are requested
+    from a shared thread pool (up to EMBEDDING_MAX_CONCURRENCY at a time
+    across all callers), like get_embeddings_async does for async callers.
     
     Args:
         texts: List of strings to embed
@@ -38,26 +157,177 @@ def get_embeddings(texts: List[str]) -> List[List[float]]:
     if not texts:
         return []
     
-    if not OPENAI_API_KEY:
+    keys, found, missing = _lookup_cached_embeddings(texts)
+    if missing and not OPENAI_API_KEY:
         raise ValueError("OpenAI API key not configured")
     
     try:
-        response = client.embeddings.create(
-            input=texts,
-            model=EMBEDDING_MODEL
-        )
+        if missing:
+            chunks = _chunk_texts(list(missing.values()))
+            if len(chunks) == 1:
+                chunk_embeddings = [_embed_chunk(chunks[0])]
+            else:
+                # executor.map yields chunk results in input order
+                chunk_embeddings = list(_get_embedding_executor().map(_embed_chunk, chunks))
+            embeddings = [embedding for chunk in chunk_embeddings for embedding in chunk]
+            _cache_embeddings(found, list(missing), embeddings)
+            logger.info(f"Generated embeddings for {len(missing)} unique texts ({len(texts)} requested)")
+        return [found[key] for key in keys]
+        
+    except Exception as e:
+        logger.error(f"Failed to generate embeddings: {e}")
+        raise
+
+async def get_embeddings_async(texts: List[str]) -> List[List[float]]:
+    """
+    Async variant of get_embeddings.
+    Chunks are requested concurrently (up to EMBEDDING_MAX_CONCURRENCY at a
+    time), so large batches cost roughly one round-trip per wave of chunks.
+    
+    Args:
+        texts: List of strings to embed
         
-        embeddings = [item.embedding for item in response.data]
-        logger.info(f"Generated embeddings for {len(texts)} texts")
-        return embeddings
+    Returns:
+        List of embedding vectors, in input order
+        
+    Raises:
+        Exception: If API call fails after retries
+    """
+    if not texts:
+        return []
+    
+    keys, found, missing = _lookup_cached_embeddings(texts)
+    if missing and not OPENAI_API_KEY:
+        raise ValueError("OpenAI API key not configured")
+    
+    semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+    
+    async def embed(chunk: List[str]) -> List[List[float]]:
+        async with semaphore:
+            return await _embed_chunk_async(chunk)
+    
+    try:
+        if missing:
+            chunk_embeddings = await asyncio.gather(
+                *[embed(chunk) for chunk in _chunk_texts(list(missing.values()))]
+            )
+            embeddings = [embedding for chunk in chunk_embeddings for embedding in chunk]
+            _cache_embeddings(found, list(missing), embeddings)
+            logger.info(f"Generated embeddings for {len(missing)} unique texts ({len(texts)} requested)")
+        return [found[key] for key in keys]
         
     except Exception as e:
         logger.error(f"Failed to generate embeddings: {e}")
         raise
 
+def submit_batch_embeddings(texts: Dict[str, str]) -> str:
+    """
+    Submit texts to the OpenAI Batch API for asynchronous embedding.
+    Batch jobs are billed at half the synchronous price and do not count
+    against the real-time rate limits, at the cost of up to 24h latency.
+    
+    Args:
+        texts: Mapping of custom ID to text; at most BATCH_API_MAX_REQUESTS entries
+        
+    Returns:
+        Batch job ID, to be passed to fetch_batch_embeddings
+        
+    Raises:
+        Exception: If the upload or batch creation fails
+    """
+    if not OPENAI_API_KEY:
+        raise ValueError("OpenAI API key not configured")
+    if len(texts) > BATCH_API_MAX_REQUESTS:
+        raise ValueError(f"A batch job accepts at most {BATCH_API_MAX_REQUESTS} requests")
+    
+    lines = [
+        orjson.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/embeddings",
+            "body": {"model": EMBEDDING_MODEL, "input": text, "dimensions": EMBEDDING_DIMENSION}
+        })
+        for custom_id, text in texts.items()
+    ]
+    
+    client = get_openai_client()
+    input_file = client.files.create(
+        file=("embeddings.jsonl", b"\n".join(lines)),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/embeddings",
+        completion_window="24h"
+    )
+    logger.info(f"Submitted batch {batch.id} with {len(texts)} embedding requests")
+    return batch.id
+
+def fetch_batch_embeddings(batch_id: str) -> Tuple[str, Optional[Dict[str, List[float]]]]:
+    """
+    Fetch the results of a Batch API embedding job.
+    
+    Args:
+        batch_id: ID returned by submit_batch_embeddings
+        
+    Returns:
+        Tuple (status, embeddings). embeddings maps custom ID to vector and is
+        None until the job has completed; failed requests are left out.
+    """
+    client = get_openai_client()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        return batch.status, None
+    
+    embeddings = {}
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                embeddings[record["custom_id"]] = response["body"]["data"][0]["embedding"]
+    
+    failed = batch.request_counts.failed if batch.request_counts else 0
+    logger.info(f"Fetched {len(embeddings)} embeddings from batch {batch_id} ({failed} failed)")
+    return batch.status, embeddings
+
+def normalize_embeddings(embeddings: Union[np.ndarray, List[List[float]]]) -> np.ndarray:
+    """
+    L2-normalize embeddings so that inner product equals cosine similarity.
+    The result stays a contiguous float32 matrix, which ChromaDB and FAISS
+    take as-is instead of converting nested Python lists.
+    
+    Args:
+        embeddings: Embedding vectors, as a matrix or list of lists
+        
+    Returns:
+        float32 array of shape (N, dimension) with unit-length rows
+    """
+    matrix = np.array(embeddings, dtype=np.float32, ndmin=2)
+    if matrix.size == 0:
+        return matrix.reshape(0, EMBEDDING_DIMENSION)
+    
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+# (metadata key, label) pairs, in the order they appear in the embedding text
+_EMBEDDING_TEXT_FIELDS = (
+    ("float_id", "Float ID"),
+    ("platform_number", "Platform"),
+    ("region", "Region"),
+    ("description", "Description"),
+    ("notes", "Notes"),
+)
+
 def format_float_metadata_for_embedding(metadata: Dict[str, Any]) -> str:
     """
     Format float metadata into a text string suitable for embedding.
+    Empty fields are left out, so the text (and its cached embedding) only
+    depends on the fields that are set.
     
     Args:
         metadata: Dictionary containing float metadata
@@ -65,41 +335,23 @@ def format_float_metadata_for_embedding(metadata: Dict[str, Any]) -> str:
     Returns:
         Formatted text string
     """
-    # Extract key fields for embedding
-    float_id = metadata.get('float_id', '')
-    platform_number = metadata.get('platform_number', '')
-    region = metadata.get('region', '')
-    notes = metadata.get('notes', '')
-    description = metadata.get('description', '')
-    
-    # Combine into descriptive text
-    text_parts = []
-    
-    if float_id:
-        text_parts.append(f"Float ID: {float_id}")
-    if platform_number:
-        text_parts.append(f"Platform: {platform_number}")
-    if region:
-        text_parts.append(f"Region: {region}")
-    if description:
-        text_parts.append(f"Description: {description}")
-    if notes:
-        text_parts.append(f"Notes: {notes}")
-    
-    # Add location information if available
-    lat = metadata.get('lat')
-    lon = metadata.get('lon')
+    get = metadata.get
+    
+    # Descriptive fields, then location and deployment date if available
+    text_parts = [f"{label}: {value}" for key, label in _EMBEDDING_TEXT_FIELDS if (value := get(key))]
+    
+    lat = get('lat')
+    lon = get('lon')
     if lat is not None and lon is not None:
         text_parts.append(f"Location: {lat:.2f}°N, {lon:.2f}°E")
     
-    # Add deployment date if available
-    deploy_date = metadata.get('deploy_date')
+    deploy_date = get('deploy_date')
     if deploy_date:
         text_parts.append(f"Deployed: {deploy_date}")
     
     return " ".join(text_parts)
 
-def embed_float_metadata_batch(metadata_list: List[Dict[str, Any]]) -> List[List[float]]:
+def embed_float_metadata_batch(metadata_list: List[Dict[str, Any]]) -> np.ndarray:
     """
     Generate embeddings for a batch of float metadata.
     
@@ -107,7 +359,7 @@ def embed_float_metadata_batch(metadata_list: List[Dict[str, Any]]) -> List[List
         metadata_list: List of metadata dictionaries
         
     Returns:
-        List of embedding vectors
+        float32 array of shape (N, dimension)
     """
     # Format metadata into text strings
     texts = [format_float_metadata_for_embedding(metadata) for metadata in metadata_list]
@@ -115,4 +367,21 @@ def embed_float_metadata_batch(metadata_list: List[Dict[str, Any]]) -> List[List
     # Generate embeddings
     embeddings = get_embeddings(texts)
     
-    return embeddings
\ No newline at end of file
+    return _as_embedding_matrix(embeddings)
+
+async def embed_float_metadata_batch_async(metadata_list: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Async variant of embed_float_metadata_batch.
+    
+    Args:
+        metadata_list: List of metadata dictionaries
+        
+    Returns:
+        float32 array of shape (N, dimension)
+    """
+    texts = [format_float_metadata_for_embedding(metadata) for metadata in metadata_list]
+    return _as_embedding_matrix(await get_embeddings_async(texts))
+
+def _as_embedding_matrix(embeddings: List[List[float]]) -> np.ndarray:
+    """Pack embedding vectors into one contiguous float32 matrix."""
+    return np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), EMBEDDING_DIMENSION)
@@ -0,0 +1,130 @@
+"""
+Background queue for /embed requests.
+Requests are acknowledged with a job ID as soon as they are queued; a single
+worker embeds and stores them, and their progress is polled by job ID.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from typing import Any, Dict, List, Optional
+
+from cachetools import TTLCache
+
+from .semantic_service import insert_metadata_batch_async
+from .semantic_cache import search_cache
+from .query_optimizer import query_optimizer
+
+logger = logging.getLogger(__name__)
+
+# Queue configuration
+INGEST_QUEUE_MAX_JOBS = int(os.getenv("INGEST_QUEUE_MAX_JOBS", "100"))
+INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", "512"))
+# How long finished job statuses stay available for polling
+INGEST_JOB_TTL = float(os.getenv("INGEST_JOB_TTL", "3600"))
+
+class IngestQueue:
+    """
+    Bounded queue of metadata batches with one consumer task.
+    Each job moves through queued -> running -> done | error.
+    """
+
+    def __init__(self, max_jobs: int = INGEST_QUEUE_MAX_JOBS, max_batch: int = INGEST_MAX_BATCH,
+                 job_ttl: float = INGEST_JOB_TTL):
+        """
+        Initialize the ingest queue.
+
+        Args:
+            max_jobs: Queued jobs before submit() waits for the worker
+            max_batch: Maximum records per insert call
+            job_ttl: Seconds a job status is kept
+        """
+        self.max_jobs = max_jobs
+        self.max_batch = max_batch
+        self.jobs: TTLCache = TTLCache(maxsize=100000, ttl=job_ttl)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the consumer task on the running event loop."""
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_jobs)
+        self._worker = asyncio.create_task(self._consume())
+        logger.info("Ingest queue worker started")
+
+    async def stop(self) -> None:
+        """Cancel the consumer task; queued jobs are dropped."""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        self._queue = None
+
+    async def submit(self, metadatas: List[Dict[str, Any]]) -> str:
+        """
+        Queue a metadata batch for embedding and insertion.
+        Waits for room when the queue is full.
+
+        Args:
+            metadatas: List of metadata dictionaries
+
+        Returns:
+            Job ID to poll with get_status()
+        """
+        if self._queue is None:
+            raise RuntimeError("Ingest queue is not running")
+        job_id = uuid.uuid4().hex
+        self.jobs[job_id] = {"job_id": job_id, "status": "queued", "count": len(metadatas)}
+        await self._queue.put((job_id, metadatas))
+        return job_id
+
+    def get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job's status dictionary, or None if it is unknown or expired."""
+        return self.jobs.get(job_id)
+
+    async def _consume(self) -> None:
+        """Run queued jobs one at a time."""
+        while True:
+            job_id, metadatas = await self._queue.get()
+            try:
+                await self._run(job_id, metadatas)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str, metadatas: List[Dict[str, Any]]) -> None:
+        """Insert one job in max_batch slices and record its outcome."""
+        self.jobs[job_id] = {"job_id": job_id, "status": "running", "count": len(metadatas)}
+        inserted = 0
+        result: Dict[str, Any] = {}
+        try:
+            for i in range(0, len(metadatas), self.max_batch):
+                result = await insert_metadata_batch_async(metadatas[i:i + self.max_batch])
+                if result["status"] == "error":
+                    raise RuntimeError(result["message"])
+                inserted += result["count"]
+        except Exception as e:
+            logger.error(f"Ingest job {job_id} failed after {inserted} inserts: {e}")
+            self.jobs[job_id] = {"job_id": job_id, "status": "error", "count": inserted, "message": str(e)}
+        else:
+            self.jobs[job_id] = {
+                "job_id": job_id,
+                "status": "done",
+                "count": inserted,
+                "total_vectors": result.get("total_vectors"),
+                "message": f"Inserted {inserted} of {len(metadatas)} entries"
+            }
+
+        # New vectors can change search rankings, so drop cached searches
+        if inserted:
+            await asyncio.to_thread(search_cache.clear)
+            query_optimizer.clear_vector_cache()
+            query_optimizer.clear_response_cache()
+
+
+# Global ingest queue instance
+ingest_queue = IngestQueue()
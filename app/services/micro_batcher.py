@@ -0,0 +1,86 @@
+"""
+Generic cross-request micro-batching.
+Items submitted within a short window are handed to one batch function
+call, and each caller gets back the result at its own position.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """
+    Coalesces items submitted within window_seconds (or until max_size are
+    queued) into one batch_fn call. batch_fn takes the list of items and
+    returns one result per item, in order; if it raises, or returns the
+    wrong number of results, every caller in the batch gets an exception.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], Awaitable[List[Any]]],
+                 window_seconds: float, max_size: int, name: str = "batch"):
+        """
+        Initialize the batcher.
+
+        Args:
+            batch_fn: Coroutine function mapping a list of items to their results
+            window_seconds: How long the first queued item waits for company
+            max_size: Queue length that triggers an immediate flush
+            name: Name used in log messages
+        """
+        self.batch_fn = batch_fn
+        self.window_seconds = window_seconds
+        self.max_size = max_size
+        self.name = name
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue an item and wait for its result from the next batch.
+
+        Args:
+            item: Item to process
+
+        Returns:
+            batch_fn's result for this item
+
+        Raises:
+            Exception: If the batch function fails
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """Starts a batch_fn call for everything queued so far."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await self.batch_fn([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"batch function returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            logger.error(f"Batched {self.name} of {len(batch)} items failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
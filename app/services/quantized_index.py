@@ -0,0 +1,225 @@
+"""
+Optional FAISS IVF index for large ChromaDB collections.
+Quantization stores each embedding in far fewer bytes than full float32, so
+top-k scoring on big collections is much less memory-bound:
+- "pq":   product quantization, m bytes per vector (highest compression)
+- "sq8":  int8 scalar quantization, 4x smaller with near-exact recall
+- "fp16": half precision, 2x smaller with practically exact recall
+"""
+import logging
+import os
+import threading
+from typing import List, Tuple
+
+import numpy as np
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Quantization configuration
+ENABLE_QUANTIZATION = os.getenv("ENABLE_QUANTIZATION", "0") == "1"
+QUANTIZATION_MIN_VECTORS = int(os.getenv("QUANTIZATION_MIN_VECTORS", "100000"))
+QUANTIZATION_TYPE = os.getenv("QUANTIZATION_TYPE", "pq")
+# Vectors added since the last save that trigger rewriting the index files;
+# anything left over is written by flush() at shutdown
+QUANTIZATION_SAVE_EVERY = int(os.getenv("QUANTIZATION_SAVE_EVERY", "50000"))
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+class QuantizedIndex:
+    """FAISS IVF index (PQ or scalar-quantized) over normalized embeddings, persisted next to ChromaDB."""
+
+    def __init__(self, persist_directory: str, dimension: int, nlist: int = 1024,
+                 m: int = 16, nbits: int = 8, nprobe: int = 16,
+                 min_vectors: int = QUANTIZATION_MIN_VECTORS,
+                 quantization: str = QUANTIZATION_TYPE,
+                 save_every: int = QUANTIZATION_SAVE_EVERY):
+        """
+        Initialize the quantized index.
+
+        Args:
+            persist_directory: Directory to persist the index and its ID map
+            dimension: Embedding dimension
+            nlist: Number of IVF cells
+            m: Number of PQ sub-quantizers (must divide dimension)
+            nbits: Bits per sub-quantizer code
+            nprobe: Number of IVF cells scanned per query
+            min_vectors: Collection size at which the index is built
+            quantization: Vector encoding, one of "pq", "sq8" or "fp16"
+            save_every: Unsaved additions that trigger persisting the index
+        """
+        if quantization not in ("pq", "sq8", "fp16"):
+            raise ValueError(f"Unsupported quantization type: {quantization}")
+
+        # Each encoding persists to its own files, so switching types rebuilds
+        self.index_path = os.path.join(persist_directory, f"ivf{quantization}.index")
+        self.ids_path = os.path.join(persist_directory, f"ivf{quantization}_ids.json")
+        self.quantization = quantization
+        self.dimension = dimension
+        self.nlist = nlist
+        self.m = m
+        self.nbits = nbits
+        self.nprobe = nprobe
+        self.min_vectors = min_vectors
+        self.save_every = save_every
+        self.index = None
+        self.ids: List[str] = []
+        self._id_set = set()
+        # Vectors added in memory but not yet written to disk
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+        if not ENABLE_QUANTIZATION:
+            return
+        if faiss is None:
+            logger.warning("ENABLE_QUANTIZATION is set but faiss is not installed; using ChromaDB search")
+            return
+
+        if os.path.exists(self.index_path) and os.path.exists(self.ids_path):
+            try:
+                self.index = faiss.read_index(self.index_path)
+                self.index.nprobe = self.nprobe
+                with open(self.ids_path, 'rb') as f:
+                    self.ids = orjson.loads(f.read())
+                # The two files are replaced one after the other; a crash in
+                # between leaves them out of step, so rebuild instead
+                if self.index.ntotal != len(self.ids):
+                    raise ValueError(f"index holds {self.index.ntotal} vectors but ID map has {len(self.ids)}")
+                self._id_set = set(self.ids)
+                logger.info(f"Loaded quantized index with {len(self.ids)} vectors")
+            except Exception as e:
+                logger.error(f"Failed to load quantized index: {e}")
+                self.index = None
+                self.ids = []
+                self._id_set = set()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether quantization is configured and available."""
+        return ENABLE_QUANTIZATION and faiss is not None
+
+    def is_ready(self) -> bool:
+        """Whether a trained index is available for search."""
+        return self.index is not None
+
+    def should_build(self, collection_size: int) -> bool:
+        """Whether the collection has grown large enough to build the index."""
+        return self.enabled and self.index is None and collection_size >= self.min_vectors
+
+    def build(self, ids: List[str], embeddings: np.ndarray) -> None:
+        """
+        Train the IVF index on the given embeddings and add them.
+
+        Args:
+            ids: ChromaDB IDs, in the same order as embeddings
+            embeddings: Normalized float32 embeddings of shape (N, dimension)
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+        quantizer = faiss.IndexFlatIP(self.dimension)
+        if self.quantization == "pq":
+            index = faiss.IndexIVFPQ(quantizer, self.dimension, self.nlist, self.m, self.nbits,
+                                     faiss.METRIC_INNER_PRODUCT)
+        else:
+            qtype = (faiss.ScalarQuantizer.QT_8bit if self.quantization == "sq8"
+                     else faiss.ScalarQuantizer.QT_fp16)
+            index = faiss.IndexIVFScalarQuantizer(quantizer, self.dimension, self.nlist, qtype,
+                                                  faiss.METRIC_INNER_PRODUCT)
+
+        # Train on a sample; IVF only needs a few dozen points per cell
+        sample_size = min(len(embeddings), self.nlist * 64)
+        sample = embeddings[np.random.choice(len(embeddings), sample_size, replace=False)]
+        index.train(sample)
+        index.add(embeddings)
+        index.nprobe = self.nprobe
+
+        with self._lock:
+            self.index = index
+            self.ids = list(ids)
+            self._id_set = set(self.ids)
+            self._unsaved = len(self.ids)
+            self._save()
+        logger.info(f"Built {self.quantization} quantized index over {len(self.ids)} vectors")
+
+    def add(self, ids: List[str], embeddings: np.ndarray) -> None:
+        """
+        Add normalized embeddings to a trained index, skipping IDs it already holds.
+        The index is only written to disk once save_every vectors have
+        accumulated; call flush() to persist the rest.
+        """
+        if self.index is None:
+            return
+        with self._lock:
+            new_rows = [i for i, vector_id in enumerate(ids) if vector_id not in self._id_set]
+            if not new_rows:
+                return
+            embeddings = np.asarray(embeddings, dtype=np.float32)[new_rows]
+            self.index.add(np.ascontiguousarray(embeddings))
+            new_ids = [ids[i] for i in new_rows]
+            self.ids.extend(new_ids)
+            self._id_set.update(new_ids)
+            self._unsaved += len(new_ids)
+            if self._unsaved >= self.save_every:
+                self._save()
+
+    def flush(self) -> None:
+        """Persist any additions not yet written to disk."""
+        with self._lock:
+            if self.index is not None and self._unsaved:
+                self._save()
+
+    def search(self, query_embedding: np.ndarray, top_k: int) -> List[Tuple[float, str]]:
+        """
+        Search the quantized index.
+
+        Args:
+            query_embedding: Normalized query embedding
+            top_k: Number of results to return
+
+        Returns:
+            List of (distance, id) tuples, with distance = 1 - inner product
+            to match ChromaDB's "ip" space
+        """
+        query = np.ascontiguousarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        scores, positions = self.index.search(query, top_k)
+        return [
+            (1.0 - float(score), self.ids[position])
+            for score, position in zip(scores[0], positions[0])
+            if position != -1
+        ]
+
+    def reset(self) -> None:
+        """Drop the index and its persisted files."""
+        with self._lock:
+            self.index = None
+            self.ids = []
+            self._id_set = set()
+            self._unsaved = 0
+            for path in (self.index_path, self.ids_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _save(self) -> None:
+        """
+        Persist the index and its ID map. Each file is written to a temporary
+        path and swapped in with os.replace, so readers never see a partial
+        file. On failure the additions stay unsaved and the next save retries.
+        Callers hold self._lock.
+        """
+        index_tmp = f"{self.index_path}.tmp"
+        ids_tmp = f"{self.ids_path}.tmp"
+        try:
+            faiss.write_index(self.index, index_tmp)
+            with open(ids_tmp, 'wb') as f:
+                f.write(orjson.dumps(self.ids))
+            os.replace(index_tmp, self.index_path)
+            os.replace(ids_tmp, self.ids_path)
+            self._unsaved = 0
+        except Exception as e:
+            logger.error(f"Failed to persist quantized index ({self._unsaved} vectors unsaved): {e}")
+            for path in (index_tmp, ids_tmp):
+                if os.path.exists(path):
+                    os.remove(path)
@@ -3,37 +3,105 @@ Intelligent query optimization service that routes queries between SQL and Vecto
 based on performance, query type, and success probability.
 """
 import asyncio
+import hashlib
+import os
+import threading
 import time
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List, Tuple, Optional, Union
 from sqlalchemy.orm import Session
 import logging
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
-import re
 
 from .. import langchain_services
-from .semantic_service import semantic_search, classify_query_type, get_embeddings
+from .semantic_service import semantic_search_batch, classify_query_type
+from .embedding_service import get_embeddings_async
 from .vector_db import chroma_db
+from .micro_batcher import MicroBatcher
+from .semantic_cache import nl_query_cache, search_cache
 
 logger = logging.getLogger(__name__)
 
+# Dedicated threads for blocking agent runs. Agent calls can take up to
+# sql_timeout seconds, so they get their own pool instead of asyncio's default
+# executor, which also serves the short to_thread calls (cache lookups, file
+# parsing) and would otherwise be starved under load.
+SQL_EXECUTOR_WORKERS = int(os.getenv("SQL_EXECUTOR_WORKERS", "16"))
+_SQL_EXECUTOR = ThreadPoolExecutor(max_workers=SQL_EXECUTOR_WORKERS, thread_name_prefix="sql")
+
+# Best similarity a vector hit needs before the concurrent strategy stops
+# waiting for SQL; weaker hits still wait for the SQL side
+VECTOR_MIN_QUALITY = float(os.getenv("VECTOR_MIN_QUALITY", "0.5"))
+
+# Weight of the newest sample in the response-time and success-rate
+# moving averages used for adaptive routing
+STATS_EWMA_ALPHA = float(os.getenv("STATS_EWMA_ALPHA", "0.1"))
+
+# Micro-batching window and size for concurrent vector searches
+VECTOR_BATCH_WINDOW_SECONDS = float(os.getenv("VECTOR_BATCH_WINDOW_MS", "5")) / 1000
+VECTOR_BATCH_MAX_SIZE = int(os.getenv("VECTOR_BATCH_MAX_SIZE", "32"))
+
+async def _search_vector_batch(requests: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    """
+    Run several vector searches as one batch: the queries are embedded with
+    one get_embeddings_async call and searched with one ChromaDB query, then
+    each request gets its own slice of the results.
+    """
+    queries = [query for query, _ in requests]
+    try:
+        embeddings = await get_embeddings_async(queries)
+        # Search once at the largest top_k and trim per request
+        results = await asyncio.to_thread(
+            semantic_search_batch, queries, max(top_k for _, top_k in requests), embeddings
+        )
+    except Exception as e:
+        logger.error(f"Batched vector search failed: {e}")
+        return [{"status": "error", "message": str(e)} for _ in requests]
+    
+    return [
+        {**result, "results": result["results"][:top_k]} if result.get("status") == "success" else result
+        for (_, top_k), result in zip(requests, results)
+    ]
+
 class QueryOptimizer:
     """Intelligent query router with performance monitoring and fallback logic."""
     
-    def __init__(self, sql_timeout: float = 30.0, vector_timeout: float = 10.0):
+    def __init__(self, sql_timeout: float = 30.0, vector_timeout: float = 10.0,
+                 min_quality: float = VECTOR_MIN_QUALITY):
         """
         Initialize query optimizer.
         
         Args:
             sql_timeout: Timeout for SQL queries in seconds
             vector_timeout: Timeout for vector queries in seconds
+            min_quality: Minimum top similarity for a vector result to end the
+                concurrent strategy early
         """
         self.sql_timeout = sql_timeout
+        self.min_quality = min_quality
         self.vector_timeout = vector_timeout
+        # Exponentially weighted averages track current health; old samples
+        # (e.g. slow queries at startup) decay instead of weighing forever
         self.performance_stats = {
-            "sql_queries": {"count": 0, "total_time": 0, "failures": 0},
-            "vector_queries": {"count": 0, "total_time": 0, "failures": 0},
-            "concurrent_queries": {"count": 0, "total_time": 0}
+            "sql_queries": {"count": 0, "failures": 0, "ewma_time": 0.0, "ewma_success": 0.0},
+            "vector_queries": {"count": 0, "failures": 0, "ewma_time": 0.0, "ewma_success": 0.0},
+            "concurrent_queries": {"count": 0, "failures": 0, "ewma_time": 0.0, "ewma_success": 0.0}
         }
+        # One lock per stats bucket so SQL, vector and concurrent updates
+        # never contend with each other
+        self._stats_locks = {bucket: threading.Lock() for bucket in self.performance_stats}
+        # Recent vector search results keyed on (query, top_k); five minutes
+        # bounds staleness after new vectors are added
+        self._vector_cache = TTLCache(maxsize=4096, ttl=300)
+        self._vector_cache_lock = threading.Lock()
+        # Whole /query/optimized responses keyed on a hash of strategy + query,
+        # so literal repeats (e.g. dashboard polling) skip classification and
+        # embedding. Only touched from the event loop.
+        self.response_cache = TTLCache(maxsize=10000, ttl=300)
+        # Concurrent vector searches share one embedding call and one ChromaDB query
+        self._search_batcher = MicroBatcher(
+            _search_vector_batch, VECTOR_BATCH_WINDOW_SECONDS, VECTOR_BATCH_MAX_SIZE, name="vector search"
+        )
         
     async def optimize_query(self, query: str, db: Session, 
                            strategy: str = "adaptive") -> Dict[str, Any]:
@@ -135,39 +203,43 @@ class QueryOptimizer:
         sql_task = asyncio.create_task(self._execute_sql_query(query, db))
         vector_task = asyncio.create_task(self._execute_vector_query(query))
         
-        # Wait for both to complete
-        sql_result, vector_result = await asyncio.gather(sql_task, vector_task, return_exceptions=True)
+        # Return as soon as one side has useful results and cancel the other;
+        # if the first to finish came back empty (or, for vector search, only
+        # weak matches), keep waiting for the other
+        pending = {sql_task, vector_task}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if (sql_task in done and self._has_results(sql_task)) or \
+                    (vector_task in done and self._has_results(vector_task, self.min_quality)):
+                for task in pending:
+                    task.cancel()
+                break
         
-        # Handle exceptions
-        if isinstance(sql_result, Exception):
-            sql_result = {"status": "error", "message": str(sql_result)}
-        if isinstance(vector_result, Exception):
-            vector_result = {"status": "error", "message": str(vector_result)}
+        sql_result = self._task_result(sql_task)
+        vector_result = self._task_result(vector_task)
         
         # Combine results
         combined_results = []
         
         if sql_result.get("status") == "success":
-            sql_items = sql_result.get("results", [])
-            for item in sql_items:
-                combined_results.append({
-                    "source": "sql",
-                    "data": item,
-                    "score": 1.0  # SQL results get perfect score
-                })
+            # SQL results get perfect score
+            combined_results.extend(
+                {"source": "sql", "data": item, "score": 1.0}
+                for item in sql_result.get("results", [])
+            )
         
         if vector_result.get("status") == "success":
-            vector_items = vector_result.get("results", [])
-            for item in vector_items:
-                combined_results.append({
+            combined_results.extend(
+                {
                     "source": "vector",
                     "data": item.get("metadata", {}),
                     "score": item.get("similarity_score", 0.0)
-                })
+                }
+                for item in vector_result.get("results", [])
+            )
         
         # Update performance stats
-        self.performance_stats["concurrent_queries"]["count"] += 1
-        self.performance_stats["concurrent_queries"]["total_time"] += time.time() - start_time
+        self._record_success("concurrent_queries", time.time() - start_time)
         
         return {
             "status": "success" if combined_results else "no_results",
@@ -178,6 +250,31 @@ class QueryOptimizer:
             "message": f"Concurrent search returned {len(combined_results)} results"
         }
     
+    @staticmethod
+    def _task_result(task: asyncio.Task) -> Dict[str, Any]:
+        """Get a query task's result dict, mapping cancellation and exceptions to a status."""
+        if task.cancelled():
+            return {"status": "cancelled"}
+        if task.exception() is not None:
+            return {"status": "error", "message": str(task.exception())}
+        return task.result()
+    
+    @classmethod
+    def _has_results(cls, task: asyncio.Task, min_quality: Optional[float] = None) -> bool:
+        """
+        Check whether a finished query task produced usable results.
+        
+        Args:
+            task: Finished SQL or vector query task
+            min_quality: If given, the best result's similarity_score must reach it
+        """
+        result = cls._task_result(task)
+        if result.get("status") != "success" or not result.get("results"):
+            return False
+        if min_quality is None:
+            return True
+        return max(item.get("similarity_score", 0.0) for item in result["results"]) >= min_quality
+    
     async def _adaptive_strategy(self, query: str, db: Session, query_type: str) -> Dict[str, Any]:
         """Adaptive strategy based on query type and historical performance."""
         sql_avg_time = self._get_avg_response_time("sql")
@@ -211,31 +308,34 @@ class QueryOptimizer:
         start_time = time.time()
         
         try:
-            # Use ThreadPoolExecutor to run SQL query with timeout
-            with ThreadPoolExecutor() as executor:
-                future = executor.submit(langchain_services.handle_natural_language_query, query)
-                try:
-                    result = future.result(timeout=self.sql_timeout)
-                    
-                    # Update performance stats
-                    self.performance_stats["sql_queries"]["count"] += 1
-                    self.performance_stats["sql_queries"]["total_time"] += time.time() - start_time
-                    
-                    return {
-                        "status": "success",
-                        "results": [result],  # Wrap in list for consistency
-                        "response_time": time.time() - start_time
-                    }
-                    
-                except FutureTimeoutError:
-                    self.performance_stats["sql_queries"]["failures"] += 1
-                    return {
-                        "status": "timeout", 
-                        "message": f"SQL query timed out after {self.sql_timeout}s"
-                    }
-                    
+            # Run the blocking agent call on the shared SQL pool so the event
+            # loop stays free (and the vector query can overlap it)
+            loop = asyncio.get_running_loop()
+            result = await asyncio.wait_for(
+                loop.run_in_executor(_SQL_EXECUTOR, langchain_services.handle_natural_language_query, query),
+                timeout=self.sql_timeout
+            )
+            
+            # Update performance stats
+            self._record_success("sql_queries", time.time() - start_time)
+            
+            # Results are always a list; only a single answer dict is wrapped
+            results = result if isinstance(result, list) else [result]
+            
+            return {
+                "status": "success",
+                "results": results,
+                "response_time": time.time() - start_time
+            }
+            
+        except asyncio.TimeoutError:
+            self._record_failure("sql_queries")
+            return {
+                "status": "timeout", 
+                "message": f"SQL query timed out after {self.sql_timeout}s"
+            }
         except Exception as e:
-            self.performance_stats["sql_queries"]["failures"] += 1
+            self._record_failure("sql_queries")
             logger.error(f"SQL query failed: {e}")
             return {"status": "error", "message": str(e)}
     
@@ -251,25 +351,58 @@ class QueryOptimizer:
             )
             
             # Update performance stats
-            self.performance_stats["vector_queries"]["count"] += 1
-            self.performance_stats["vector_queries"]["total_time"] += time.time() - start_time
+            self._record_success("vector_queries", time.time() - start_time)
             
             return vector_result
             
         except asyncio.TimeoutError:
-            self.performance_stats["vector_queries"]["failures"] += 1
+            self._record_failure("vector_queries")
             return {
                 "status": "timeout",
                 "message": f"Vector query timed out after {self.vector_timeout}s"
             }
         except Exception as e:
-            self.performance_stats["vector_queries"]["failures"] += 1
+            self._record_failure("vector_queries")
             logger.error(f"Vector query failed: {e}")
             return {"status": "error", "message": str(e)}
     
-    async def _run_vector_search(self, query: str) -> Dict[str, Any]:
-        """Run vector search in async context."""
-        return semantic_search(query, top_k=10)
+    async def _run_vector_search(self, query: str, top_k: int = 10) -> Dict[str, Any]:
+        """
+        Run a vector search through the shared micro-batcher, serving repeats
+        from cache. Searches arriving together are embedded in one API call
+        and searched with one ChromaDB query.
+        """
+        cache_key = hashlib.blake2b(f"{top_k}|{query}".encode(), digest_size=16).digest()
+        with self._vector_cache_lock:
+            cached = self._vector_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        result = await self._search_batcher.submit((query, top_k))
+        if result.get("status") == "success":
+            with self._vector_cache_lock:
+                self._vector_cache[cache_key] = result
+        return result
+    
+    def clear_vector_cache(self) -> None:
+        """Drop cached vector search results (e.g. after new vectors are added)."""
+        with self._vector_cache_lock:
+            self._vector_cache.clear()
+    
+    def clear_response_cache(self) -> None:
+        """Drop cached /query/optimized responses (e.g. after new data is ingested)."""
+        self.response_cache.clear()
+    
+    async def invalidate_caches(self) -> None:
+        """
+        Drop every cached query result: the semantic search and NL answer
+        caches as well as this optimizer's vector and response caches.
+        Called once new floats, profiles or vectors have been stored.
+        """
+        await asyncio.to_thread(search_cache.clear)
+        await asyncio.to_thread(nl_query_cache.clear)
+        self.clear_vector_cache()
+        self.clear_response_cache()
     
     def _choose_adaptive_strategy(self, query_type: str) -> str:
         """Choose the best strategy based on query type and performance history."""
@@ -285,19 +418,50 @@ class QueryOptimizer:
         else:
             return "sql_first"  # Default fallback
     
+    def _record_success(self, bucket: str, elapsed: float):
+        """Record a completed query in a stats bucket."""
+        with self._stats_locks[bucket]:
+            stats = self.performance_stats[bucket]
+            # The first completed query seeds the time average
+            if stats["count"] == 0:
+                stats["ewma_time"] = elapsed
+            else:
+                stats["ewma_time"] += STATS_EWMA_ALPHA * (elapsed - stats["ewma_time"])
+            self._update_success_ewma(stats, 1.0)
+            stats["count"] += 1
+    
+    def _record_failure(self, bucket: str):
+        """Record a failed query in a stats bucket."""
+        with self._stats_locks[bucket]:
+            stats = self.performance_stats[bucket]
+            self._update_success_ewma(stats, 0.0)
+            stats["failures"] += 1
+    
+    @staticmethod
+    def _update_success_ewma(stats: Dict[str, Any], sample: float) -> None:
+        """Fold one success (1.0) or failure (0.0) into a bucket's success average."""
+        if stats["count"] + stats["failures"] == 0:
+            stats["ewma_success"] = sample
+        else:
+            stats["ewma_success"] += STATS_EWMA_ALPHA * (sample - stats["ewma_success"])
+    
+    def _get_bucket_stats(self, bucket: str) -> Dict[str, Any]:
+        """Get a consistent copy of a stats bucket."""
+        lock = self._stats_locks.get(bucket)
+        if lock is None:
+            return {}
+        with lock:
+            return dict(self.performance_stats[bucket])
+    
     def _get_avg_response_time(self, db_type: str) -> float:
-        """Get average response time for a database type."""
-        stats = self.performance_stats.get(f"{db_type}_queries", {})
-        count = stats.get("count", 0)
-        total_time = stats.get("total_time", 0)
-        return total_time / count if count > 0 else 0.0
+        """Get the moving average response time for a database type."""
+        stats = self._get_bucket_stats(f"{db_type}_queries")
+        return stats.get("ewma_time", 0.0)
     
     def _get_success_rate(self, db_type: str) -> float:
-        """Get success rate for a database type."""
-        stats = self.performance_stats.get(f"{db_type}_queries", {})
-        count = stats.get("count", 0)
-        failures = stats.get("failures", 0)
-        return (count - failures) / count if count > 0 else 0.0
+        """Get the moving average success rate for a database type."""
+        stats = self._get_bucket_stats(f"{db_type}_queries")
+        return stats.get("ewma_success", 0.0)
     
     def _get_performance_summary(self) -> Dict[str, Any]:
         """Get summary of performance statistics."""
@@ -305,26 +469,25 @@ class QueryOptimizer:
             "sql": {
                 "avg_response_time": self._get_avg_response_time("sql"),
                 "success_rate": self._get_success_rate("sql"),
-                "total_queries": self.performance_stats["sql_queries"]["count"]
+                "total_queries": self._get_bucket_stats("sql_queries")["count"]
             },
             "vector": {
                 "avg_response_time": self._get_avg_response_time("vector"),
                 "success_rate": self._get_success_rate("vector"),
-                "total_queries": self.performance_stats["vector_queries"]["count"]
+                "total_queries": self._get_bucket_stats("vector_queries")["count"]
             },
             "concurrent": {
                 "avg_response_time": self._get_avg_response_time("concurrent"),
-                "total_queries": self.performance_stats["concurrent_queries"]["count"]
+                "total_queries": self._get_bucket_stats("concurrent_queries")["count"]
             }
         }
     
     def reset_stats(self):
         """Reset performance statistics."""
-        self.performance_stats = {
-            "sql_queries": {"count": 0, "total_time": 0, "failures": 0},
-            "vector_queries": {"count": 0, "total_time": 0, "failures": 0},
-            "concurrent_queries": {"count": 0, "total_time": 0}
-        }
+        for bucket, lock in self._stats_locks.items():
+            with lock:
+                for key in self.performance_stats[bucket]:
+                    self.performance_stats[bucket][key] = 0
 
 
 # Global query optimizer instance with increased timeouts
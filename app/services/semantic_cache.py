@@ -0,0 +1,384 @@
+"""
+Semantic response cache for natural language and vector search queries.
+Paraphrased repeats of a query are answered from a stored response instead of
+re-running the LangChain agent or the vector search.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+from .vector_db import chroma_db
+from .embedding_service import EMBEDDING_DIMENSION, EMBEDDING_MODEL, get_embeddings
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+MEMORY_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_MEMORY_SIZE", "1024"))
+# Minimum seconds between deletions of expired entries from the ChromaDB tier
+CACHE_PRUNE_INTERVAL = float(os.getenv("SEMANTIC_CACHE_PRUNE_INTERVAL", "300"))
+# Optional Redis tier for exact repeats, shared by all workers
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Numbers and IDs in a query (the classifier's \d+\.?\d* form). Queries that
+# differ only in these embed almost identically, so they are matched exactly.
+_NUMBER_RE = re.compile(r"\d+\.?\d*")
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+@lru_cache(maxsize=1)
+def get_redis_client():
+    """Return the shared Redis client, or None if Redis is not configured."""
+    if not REDIS_URL:
+        return None
+    if redis is None:
+        logger.warning("REDIS_URL is set but redis is not installed; using in-process caches only")
+        return None
+    return redis.Redis.from_url(REDIS_URL)
+
+class SemanticCache:
+    """
+    Two-tier response cache.
+
+    1. In-memory LRU keyed on the normalized query text (exact repeats),
+       backed by Redis with the same keys when REDIS_URL is set, so exact
+       repeats are shared across workers and restarts.
+    2. Past query embeddings; the nearest cached query is a hit when its
+       cosine similarity is at least the threshold. The most recent
+       memory_size embeddings are scored in-process with one matrix-vector
+       product before falling back to the ChromaDB collection holding all
+       of them. Expired entries are deleted from the collection at most
+       every CACHE_PRUNE_INTERVAL seconds as new responses are stored.
+       The numbers in a query (thresholds, float IDs) are part of its
+       similarity scope, so "above 20" never answers "above 25".
+
+    Lookups and stores run in worker threads (asyncio.to_thread), so the
+    in-memory tier is guarded by a lock.
+    """
+
+    def __init__(self, name: str, similarity_threshold: float = SIMILARITY_THRESHOLD,
+                 ttl_seconds: float = CACHE_TTL_SECONDS, memory_size: int = MEMORY_CACHE_SIZE):
+        """
+        Initialize a semantic cache.
+
+        Args:
+            name: Cache name, used to derive the ChromaDB collection name
+            similarity_threshold: Minimum cosine similarity for a semantic hit
+            ttl_seconds: Lifetime of a cached response
+            memory_size: Maximum number of entries in the in-memory tier
+        """
+        self.name = name
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._next_prune = 0.0
+        self.redis = get_redis_client()
+
+        # Ring buffer of recent normalized query embeddings, with
+        # (scope, expires_at, response) for each row
+        self._recent = np.zeros((memory_size, EMBEDDING_DIMENSION), dtype=np.float32)
+        self._recent_entries: List[Optional[Tuple[str, float, Any]]] = [None] * memory_size
+        self._recent_count = 0
+        self._recent_next = 0
+        self._recent_lock = threading.Lock()
+
+        collection_name = f"semantic_cache_{name}"
+        collection_metadata = {
+            "hnsw:space": "cosine",
+            "description": f"Semantic cache for {name} responses",
+            "embedding_model": f"{EMBEDDING_MODEL}/{EMBEDDING_DIMENSION}"
+        }
+        self.collection = chroma_db.client.get_or_create_collection(
+            name=collection_name,
+            metadata=collection_metadata
+        )
+
+        # Entries embedded with another model are unusable; start the cache over
+        if (self.collection.metadata or {}).get("embedding_model") != collection_metadata["embedding_model"]:
+            chroma_db.client.delete_collection(name=collection_name)
+            self.collection = chroma_db.client.create_collection(
+                name=collection_name,
+                metadata=collection_metadata
+            )
+
+    def lookup(self, query: str, scope: str = "",
+               embedding: Optional[List[float]] = None) -> Tuple[Optional[Any], Optional[List[float]]]:
+        """
+        Look up a cached response for a query: the exact tiers first, then
+        the similarity tier.
+
+        Args:
+            query: Query text
+            scope: Extra key material that must match exactly (e.g. top_k)
+            embedding: Optional precomputed query embedding for the similarity tier
+
+        Returns:
+            Tuple (response, embedding). response is None on a miss; embedding
+            is the query embedding computed for the lookup (None on an exact
+            hit or if embedding failed) and can be passed back to store().
+        """
+        response = self.lookup_exact(query, scope)
+        if response is not None:
+            return response, None
+        return self.lookup_similar(query, scope, embedding)
+
+    def lookup_exact(self, query: str, scope: str = "") -> Optional[Any]:
+        """
+        Look up an exact repeat of a query in memory, then in Redis.
+        Needs no embedding, so callers can try it before embedding the query.
+
+        Args:
+            query: Query text
+            scope: Extra key material that must match exactly (e.g. top_k)
+
+        Returns:
+            Cached response, or None on a miss
+        """
+        key = self._key(query, scope)
+
+        response = self._lookup_memory(key)
+        if response is not None:
+            logger.debug(f"Semantic cache '{self.name}' exact hit for query: '{query}'")
+            return response
+
+        if self.redis is not None:
+            try:
+                cached = self.redis.get(self._redis_key(key))
+                if cached is not None:
+                    response = orjson.loads(cached)
+                    self._remember(key, response)
+                    logger.debug(f"Semantic cache '{self.name}' Redis hit for query: '{query}'")
+                    return response
+            except Exception as e:
+                logger.warning(f"Semantic cache '{self.name}' Redis lookup failed: {e}")
+        return None
+
+    def lookup_similar(self, query: str, scope: str = "",
+                       embedding: Optional[List[float]] = None) -> Tuple[Optional[Any], Optional[List[float]]]:
+        """
+        Look up the nearest cached query by embedding similarity.
+
+        Args:
+            query: Query text
+            scope: Extra key material that must match exactly (e.g. top_k)
+            embedding: Optional precomputed query embedding; computed if missing
+
+        Returns:
+            Tuple (response, embedding) as for lookup()
+        """
+        key = self._key(query, scope)
+        scope = self._similarity_scope(query, scope)
+
+        # Tier 2: in-process ring buffer, then the ChromaDB collection
+        if embedding is None:
+            try:
+                embedding = get_embeddings([query])[0]
+            except Exception as e:
+                logger.warning(f"Semantic cache '{self.name}' lookup skipped: {e}")
+                return None, None
+
+        try:
+            response = self._lookup_recent(embedding, scope)
+            if response is not None:
+                self._remember(key, response)
+                logger.debug(f"Semantic cache '{self.name}' in-memory similarity hit for query: '{query}'")
+                return response, embedding
+
+            if self.collection.count() == 0:
+                return None, embedding
+
+            results = self.collection.query(
+                query_embeddings=[embedding],
+                n_results=1,
+                # Expired entries that have not been pruned yet are skipped
+                where={"$and": [{"scope": scope}, {"created_at": {"$gt": time.time() - self.ttl_seconds}}]},
+                include=['metadatas', 'distances']
+            )
+            if not results['distances'] or not results['distances'][0]:
+                return None, embedding
+
+            distance = results['distances'][0][0]
+            metadata = results['metadatas'][0][0]
+
+            # Cosine distance is 1 - cosine similarity
+            if 1.0 - distance < self.similarity_threshold:
+                return None, embedding
+            if metadata["created_at"] + self.ttl_seconds <= time.time():
+                return None, embedding
+
+            response = orjson.loads(metadata["response"])
+            self._remember(key, response)
+            logger.debug(f"Semantic cache '{self.name}' similarity hit ({1.0 - distance:.3f}) for query: '{query}'")
+            return response, embedding
+
+        except Exception as e:
+            logger.warning(f"Semantic cache '{self.name}' lookup failed: {e}")
+            return None, embedding
+
+    def store(self, query: str, response: Any, embedding: Optional[List[float]] = None,
+              scope: str = "") -> None:
+        """
+        Store a response for a query.
+
+        Args:
+            query: Query text
+            response: JSON-serializable response
+            embedding: Query embedding returned by lookup(), if available
+            scope: Extra key material that must match exactly (e.g. top_k)
+        """
+        key = self._key(query, scope)
+        self._remember(key, response)
+        scope = self._similarity_scope(query, scope)
+
+        if self.redis is not None:
+            try:
+                self.redis.setex(self._redis_key(key), int(self.ttl_seconds),
+                                 self._serialize(response))
+            except Exception as e:
+                logger.warning(f"Semantic cache '{self.name}' Redis store failed: {e}")
+
+        try:
+            if embedding is None:
+                embedding = get_embeddings([query])[0]
+
+            self._remember_recent(embedding, scope, response)
+            self.collection.upsert(
+                ids=[key],
+                embeddings=[embedding],
+                documents=[query],
+                metadatas=[{
+                    "scope": scope,
+                    "created_at": time.time(),
+                    "response": self._serialize(response).decode()
+                }]
+            )
+        except Exception as e:
+            logger.warning(f"Semantic cache '{self.name}' store failed: {e}")
+        
+        self._prune_expired()
+
+    def clear(self) -> None:
+        """Drop all cached responses."""
+        with self._memory_lock:
+            self._memory.clear()
+        with self._recent_lock:
+            self._recent_entries = [None] * self.memory_size
+            self._recent_count = 0
+            self._recent_next = 0
+        if self.redis is not None:
+            try:
+                keys = list(self.redis.scan_iter(match=self._redis_key("*")))
+                if keys:
+                    self.redis.delete(*keys)
+            except Exception as e:
+                logger.error(f"Failed to clear Redis tier of semantic cache '{self.name}': {e}")
+        try:
+            ids = self.collection.get(include=[])['ids']
+            if ids:
+                self.collection.delete(ids=ids)
+        except Exception as e:
+            logger.error(f"Failed to clear semantic cache '{self.name}': {e}")
+
+    def _lookup_memory(self, key: str) -> Optional[Any]:
+        """Return a live in-memory response, dropping the entry if it has expired."""
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, response = entry
+            if expires_at <= time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return response
+
+    def _remember(self, key: str, response: Any) -> None:
+        """Insert into the in-memory tier, evicting the least recently used entry."""
+        with self._memory_lock:
+            self._memory[key] = (time.time() + self.ttl_seconds, response)
+            self._memory.move_to_end(key)
+            if len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _prune_expired(self) -> None:
+        """Delete expired entries from the ChromaDB tier, at most every CACHE_PRUNE_INTERVAL seconds."""
+        now = time.time()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + CACHE_PRUNE_INTERVAL
+        try:
+            self.collection.delete(where={"created_at": {"$lt": now - self.ttl_seconds}})
+        except Exception as e:
+            logger.warning(f"Semantic cache '{self.name}' prune failed: {e}")
+
+    def _lookup_recent(self, embedding: List[float], scope: str) -> Optional[Any]:
+        """Find the most similar live recent query in the same scope, if similar enough."""
+        with self._recent_lock:
+            count = self._recent_count
+            if count == 0:
+                return None
+            query = np.array(embedding, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            similarities = self._recent[:count] @ query
+            entries = self._recent_entries[:count]
+
+        # Candidates above the threshold, most similar first
+        candidates = np.flatnonzero(similarities >= self.similarity_threshold)
+        now = time.time()
+        for row in candidates[np.argsort(similarities[candidates])[::-1]]:
+            entry_scope, expires_at, response = entries[row]
+            if entry_scope == scope and expires_at > now:
+                return response
+        return None
+
+    def _remember_recent(self, embedding: List[float], scope: str, response: Any) -> None:
+        """Add a query embedding to the ring buffer, overwriting the oldest row when full."""
+        vector = np.array(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._recent_lock:
+            row = self._recent_next
+            self._recent[row] = vector
+            self._recent_entries[row] = (scope, time.time() + self.ttl_seconds, response)
+            self._recent_next = (row + 1) % self.memory_size
+            self._recent_count = min(self._recent_count + 1, self.memory_size)
+
+    @staticmethod
+    def _serialize(response: Any) -> bytes:
+        """Serialize a response to JSON, stringifying anything orjson can't encode."""
+        return orjson.dumps(response, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+    def _redis_key(self, key: str) -> str:
+        """Namespace a cache key for Redis."""
+        return f"semcache:{self.name}:{key}"
+
+    @staticmethod
+    def _similarity_scope(query: str, scope: str) -> str:
+        """Append the query's numbers to its scope, so a similarity hit needs the same numbers."""
+        numbers = _NUMBER_RE.findall(query)
+        return f"{scope}#{','.join(numbers)}" if numbers else scope
+
+    @staticmethod
+    def _key(query: str, scope: str) -> str:
+        """Hash the normalized query text and scope into a cache key."""
+        normalized = " ".join(query.lower().split())
+        return hashlib.blake2b(f"{scope}|{normalized}".encode(), digest_size=16).hexdigest()
+
+
+# Global semantic cache instances
+nl_query_cache = SemanticCache("nl_query")
+search_cache = SemanticCache("search")
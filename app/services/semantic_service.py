@@ -2,19 +2,53 @@
 Semantic search service that combines vector database and embedding operations.
 Updated to use ChromaDB and optimized query routing.
 """
+import asyncio
 import numpy as np
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional
 import logging
 import re
+from functools import lru_cache
 
 from .vector_db import chroma_db
-from .embedding_service import get_embeddings, embed_float_metadata_batch
+from .embedding_service import (
+    EMBEDDING_MODEL, get_embeddings, embed_float_metadata_batch, embed_float_metadata_batch_async
+)
 
 logger = logging.getLogger(__name__)
 
+# Numeric/spatial indicator words
+NUMERIC_WORDS = frozenset({
+    "latitude", "longitude", "lat", "lon", "depth", "temperature", "temp", "salinity", "pressure",
+    "north", "south", "east", "west", "equator", "arctic", "antarctic",
+    "recent", "last", "latest", "current", "today", "yesterday", "month", "year",
+})
+
+# Numeric/spatial indicators that are more than a single word
+NUMERIC_PATTERNS = [
+    r'\b\d+\.?\d*\s*(degrees?|°)\b',  # Coordinates
+    r'\b(greater|less|more|higher|lower|above|below|between|range)\s+than\b',
+    r'\b\d+\.?\d*\s*(m|meters?|km|kilometers?|°c|celsius|psu)\b'
+]
+
+# Semantic indicator words
+SEMANTIC_WORDS = frozenset({
+    "describe", "description", "about", "characteristics", "features", "type", "kind",
+    "similar", "like", "related", "comparable",
+    "research", "study", "experiment", "project", "program",
+    "mission", "deployment", "purpose", "objective",
+})
+
+# Word tokens; \w+ runs split exactly where the \b word boundaries of the
+# indicator patterns fall
+_TOKEN_RE = re.compile(r"\w+")
+# Remaining numeric patterns, compiled into one case-insensitive alternation
+_NUMERIC_RE = re.compile("|".join(f"(?:{p})" for p in NUMERIC_PATTERNS), re.IGNORECASE)
+
 def insert_metadata_batch(metadatas: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Insert a batch of float metadata into the vector database.
+    Floats already stored (matched on float_id) are skipped without being
+    re-embedded.
     
     Args:
         metadatas: List of metadata dictionaries
@@ -23,25 +57,68 @@ def insert_metadata_batch(metadatas: List[Dict[str, Any]]) -> Dict[str, Any]:
         Dictionary with insertion status and count
     """
     try:
-        # Generate embeddings for the metadata batch
-        embeddings = embed_float_metadata_batch(metadatas)
+        new_metadatas = chroma_db.filter_new_metadatas(metadatas)
+        skipped = len(metadatas) - len(new_metadatas)
         
-        # Insert into ChromaDB
-        ids = chroma_db.add_vectors(embeddings, metadatas)
+        ids = []
+        if new_metadatas:
+            # Generate embeddings for the new records only
+            embeddings = embed_float_metadata_batch(new_metadatas)
+            
+            # Insert into ChromaDB
+            ids = chroma_db.add_vectors(embeddings, new_metadatas)
         
-        logger.info(f"Successfully inserted {len(metadatas)} metadata entries")
+        logger.info(f"Successfully inserted {len(new_metadatas)} metadata entries ({skipped} already stored)")
         return {
             "status": "success", 
-            "count": len(metadatas),
+            "count": len(new_metadatas),
             "total_vectors": chroma_db.count(),
-            "generated_ids": ids
+            "generated_ids": ids,
+            "message": f"Inserted {len(new_metadatas)} entries, skipped {skipped} already stored"
         }
         
     except Exception as e:
         logger.error(f"Failed to insert metadata batch: {e}")
         return {"status": "error", "message": str(e)}
 
-def semantic_search(query: str, top_k: int = 5, metadata_filter: Dict[str, Any] = None) -> Dict[str, Any]:
+async def insert_metadata_batch_async(metadatas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Async variant of insert_metadata_batch.
+    Embedding chunks are requested concurrently on the event loop, while the
+    blocking ChromaDB calls run in the default thread pool.
+    
+    Args:
+        metadatas: List of metadata dictionaries
+        
+    Returns:
+        Dictionary with insertion status and count
+    """
+    try:
+        new_metadatas = await asyncio.to_thread(chroma_db.filter_new_metadatas, metadatas)
+        skipped = len(metadatas) - len(new_metadatas)
+        
+        ids = []
+        if new_metadatas:
+            embeddings = await embed_float_metadata_batch_async(new_metadatas)
+            ids = await asyncio.to_thread(chroma_db.add_vectors, embeddings, new_metadatas)
+        
+        logger.info(f"Successfully inserted {len(new_metadatas)} metadata entries ({skipped} already stored)")
+        return {
+            "status": "success", 
+            "count": len(new_metadatas),
+            "total_vectors": await asyncio.to_thread(chroma_db.count),
+            "generated_ids": ids,
+            "message": f"Inserted {len(new_metadatas)} entries, skipped {skipped} already stored"
+        }
+        
+    except Exception as e:
+        logger.error(f"Failed to insert metadata batch: {e}")
+        return {"status": "error", "message": str(e)}
+
+def semantic_search(query: str, top_k: int = 5, metadata_filter: Dict[str, Any] = None,
+                    query_embedding: List[float] = None,
+                    include_documents: bool = False,
+                    score_threshold: Optional[float] = None) -> Dict[str, Any]:
     """
     Perform semantic search on float metadata.
     
@@ -49,46 +126,85 @@ def semantic_search(query: str, top_k: int = 5, metadata_filter: Dict[str, Any]
         query: Natural language search query
         top_k: Number of top results to return
         metadata_filter: Optional metadata filter for ChromaDB
+        query_embedding: Optional precomputed embedding of the query
+        include_documents: Whether to fetch and return each hit's document string
+        score_threshold: Optional minimum similarity score; weaker hits are
+            dropped inside the vector database before metadata is fetched
         
     Returns:
         Dictionary with search results
     """
     try:
-        # Generate embedding for the query
-        query_embeddings = get_embeddings([query])
-        if not query_embeddings:
-            return {"status": "error", "message": "Failed to generate query embedding"}
+        # Generate embedding for the query unless the caller already has one
+        if query_embedding is None:
+            query_embeddings = get_embeddings([query])
+            if not query_embeddings:
+                return {"status": "error", "message": "Failed to generate query embedding"}
+            query_embedding = query_embeddings[0]
         
         # Search in ChromaDB
         results = chroma_db.search(
-            query_embedding=query_embeddings[0], 
+            query_embedding=query_embedding, 
             top_k=top_k,
-            where=metadata_filter
+            where=metadata_filter,
+            include_documents=include_documents,
+            max_distance=None if score_threshold is None else 1.0 - score_threshold,
+            formatter=_format_hit_with_document if include_documents else _format_hit
         )
         
-        # Format results
-        formatted_results = []
-        for distance, metadata, document in results:
-            result = {
-                "metadata": metadata,
-                "document": document,
-                "similarity_score": float(1 / (1 + distance)),  # Convert distance to similarity
-                "distance": distance
-            }
-            formatted_results.append(result)
-        
-        logger.info(f"Semantic search returned {len(formatted_results)} results for query: '{query}'")
-        return {
-            "status": "success",
-            "query": query,
-            "results": formatted_results,
-            "total_searched": chroma_db.count()
-        }
+        return _format_search_results(query, results, chroma_db.count())
         
     except Exception as e:
         logger.error(f"Semantic search failed: {e}")
         return {"status": "error", "message": str(e)}
 
+def semantic_search_batch(queries: List[str], top_k: int,
+                          query_embeddings: List[List[float]]) -> List[Dict[str, Any]]:
+    """
+    Perform several unfiltered semantic searches with one ChromaDB query.
+    
+    Args:
+        queries: Natural language search queries
+        top_k: Number of top results to return per query
+        query_embeddings: Precomputed embeddings, one per query
+        
+    Returns:
+        One search result dictionary per query, shaped like semantic_search's
+    """
+    try:
+        results = chroma_db.search_batch(query_embeddings, top_k=top_k, formatter=_format_hit)
+        total_searched = chroma_db.count()
+        return [
+            _format_search_results(query, query_results, total_searched)
+            for query, query_results in zip(queries, results)
+        ]
+        
+    except Exception as e:
+        logger.error(f"Batch semantic search failed: {e}")
+        return [{"status": "error", "message": str(e)} for _ in queries]
+
+# Hit formatters handed to chroma_db, which builds each result dict straight
+# from ChromaDB's output. Every search path yields Python float distances;
+# inner-product distance is 1 - cosine similarity.
+def _format_hit(distance: float, metadata: Dict[str, Any], document: Optional[str]) -> Dict[str, Any]:
+    return {"metadata": metadata, "similarity_score": 1.0 - distance, "distance": distance}
+
+def _format_hit_with_document(distance: float, metadata: Dict[str, Any],
+                              document: Optional[str]) -> Dict[str, Any]:
+    return {"metadata": metadata, "document": document,
+            "similarity_score": 1.0 - distance, "distance": distance}
+
+def _format_search_results(query: str, formatted_results: List[Dict[str, Any]],
+                           total_searched: int) -> Dict[str, Any]:
+    """Wrap formatted hits into a search response."""
+    logger.info(f"Semantic search returned {len(formatted_results)} results for query: '{query}'")
+    return {
+        "status": "success",
+        "query": query,
+        "results": formatted_results,
+        "total_searched": total_searched
+    }
+
 def metadata_filter_search(where_filter: Dict[str, Any], limit: int = 10) -> Dict[str, Any]:
     """
     Search using metadata filters only (no semantic similarity).
@@ -114,9 +230,11 @@ def metadata_filter_search(where_filter: Dict[str, Any], limit: int = 10) -> Dic
         logger.error(f"Metadata filter search failed: {e}")
         return {"status": "error", "message": str(e)}
 
+@lru_cache(maxsize=4096)
 def classify_query_type(query: str) -> str:
     """
     Classify a query as numeric/spatial, semantic, or mixed.
+    Results are memoized per query text, since interactive clients repeat queries.
     
     Args:
         query: User query text
@@ -124,38 +242,21 @@ def classify_query_type(query: str) -> str:
     Returns:
         One of: "numeric", "semantic", "mixed"
     """
-    query_lower = query.lower()
-    
-    # Numeric/spatial indicators
-    numeric_patterns = [
-        r'\b\d+\.?\d*\s*(degrees?|°)\b',  # Coordinates
-        r'\b(latitude|longitude|lat|lon|depth|temperature|temp|salinity|pressure)\b',
-        r'\b(greater|less|more|higher|lower|above|below|between|range)\s+than\b',
-        r'\b\d+\.?\d*\s*(m|meters?|km|kilometers?|°c|celsius|psu)\b',
-        r'\b(north|south|east|west|equator|arctic|antarctic)\b',
-        r'\b(recent|last|latest|current|today|yesterday|month|year)\b'
-    ]
-    
-    # Semantic indicators
-    semantic_patterns = [
-        r'\b(describe|description|about|characteristics|features|type|kind)\b',
-        r'\b(similar|like|related|comparable)\b',
-        r'\b(research|study|experiment|project|program)\b',
-        r'\b(mission|deployment|purpose|objective)\b'
-    ]
+    # Most indicators are single words: one tokenization and set lookups
+    tokens = set(_TOKEN_RE.findall(query.lower()))
+    found_numeric = not tokens.isdisjoint(NUMERIC_WORDS)
+    found_semantic = not tokens.isdisjoint(SEMANTIC_WORDS)
     
-    numeric_matches = sum(1 for pattern in numeric_patterns if re.search(pattern, query_lower))
-    semantic_matches = sum(1 for pattern in semantic_patterns if re.search(pattern, query_lower))
+    # Coordinates, units and comparisons only matter if no numeric word was found
+    if not found_numeric:
+        found_numeric = _NUMERIC_RE.search(query) is not None
     
-    if numeric_matches > 0 and semantic_matches > 0:
+    if found_numeric and found_semantic:
         return "mixed"
-    elif numeric_matches > 0:
+    if found_numeric:
         return "numeric"
-    elif semantic_matches > 0:
-        return "semantic"
-    else:
-        # Default to semantic for ambiguous queries
-        return "semantic"
+    # Semantic matches, and ambiguous queries, default to semantic
+    return "semantic"
 
 def hybrid_rag_query(query: str, top_k: int = 5) -> Dict[str, Any]:
     """
@@ -221,14 +322,14 @@ def get_vector_status() -> Dict[str, Any]:
         return {
             "total_vectors": chroma_db.count(),
             "collection_info": collection_info,
-            "embedding_model": "text-embedding-ada-002",
+            "embedding_model": EMBEDDING_MODEL,
             "vector_db_type": "ChromaDB"
         }
     except Exception as e:
         logger.error(f"Failed to get vector status: {e}")
         return {
             "total_vectors": 0,
-            "embedding_model": "text-embedding-ada-002", 
+            "embedding_model": EMBEDDING_MODEL, 
             "vector_db_type": "ChromaDB",
             "error": str(e)
         }
\ No newline at end of file
@@ -1,38 +1,129 @@
 """
 Vector database service using ChromaDB for semantic search on ARGO float metadata.
 """
+import bisect
 import chromadb
 from chromadb.config import Settings
+import hashlib
 import numpy as np
+import orjson
 import os
-from typing import List, Tuple, Dict, Any, Optional
+from itertools import repeat
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 import logging
-import uuid
+import threading
+import time
+from functools import lru_cache
+
+from .embedding_service import EMBEDDING_DIMENSION, EMBEDDING_MODEL, normalize_embeddings
+from .quantized_index import QuantizedIndex
 
 logger = logging.getLogger(__name__)
 
+# Builds a caller's result item from (distance, metadata, document)
+HitFormatter = Callable[[float, Dict[str, Any], Optional[str]], Any]
+
+# Expected collection size, used to pick HNSW build parameters when a
+# collection is created (they cannot be changed afterwards)
+VECTOR_EXPECTED_COUNT = int(os.getenv("VECTOR_EXPECTED_COUNT", "100000"))
+
+# The collection size is cached between this process's writes; the TTL bounds
+# staleness when other workers write to the same persistent directory
+VECTOR_COUNT_TTL = float(os.getenv("VECTOR_COUNT_TTL", "5"))
+
+# Below this size, unfiltered searches score every vector with one matrix
+# product instead of walking the HNSW graph: faster at small N and exact
+EXACT_SEARCH_MAX_VECTORS = int(os.getenv("EXACT_SEARCH_MAX_VECTORS", "10000"))
+
+def hnsw_build_params(expected_count: int) -> Dict[str, int]:
+    """
+    Choose HNSW graph degree and build/query beam widths for a collection size.
+    Larger graphs need more links per node and wider searches to keep recall
+    up at the same query latency. ChromaDB's search_ef is collection-wide, so
+    it is fixed here at creation rather than changed per query.
+    
+    Args:
+        expected_count: Expected number of vectors in the collection
+        
+    Returns:
+        ChromaDB collection metadata entries for the HNSW index
+    """
+    if expected_count < 100_000:
+        return {"hnsw:M": 16, "hnsw:construction_ef": 128, "hnsw:search_ef": 64}
+    if expected_count < 1_000_000:
+        return {"hnsw:M": 24, "hnsw:construction_ef": 200, "hnsw:search_ef": 100}
+    return {"hnsw:M": 32, "hnsw:construction_ef": 256, "hnsw:search_ef": 128}
+
+def canonical_where(where: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Canonicalize a metadata filter for ChromaDB.
+    ChromaDB accepts one condition per where dict, so a multi-field filter
+    such as {"region": ..., "float_id": ...} is rewritten as an $and of
+    single-field conditions. Filters built from hashable values are cached.
+    
+    Args:
+        where: Metadata filter, or None
+        
+    Returns:
+        Equivalent filter ChromaDB accepts, or None for an empty filter
+    """
+    if not where:
+        return None
+    if len(where) == 1:
+        return where
+    items = tuple(sorted(where.items()))
+    try:
+        return _canonical_where(items)
+    except TypeError:
+        # Operator conditions (e.g. {"$gte": 5}) are dicts and cannot be cache keys
+        return {"$and": [{key: value} for key, value in items]}
+
+@lru_cache(maxsize=1024)
+def _canonical_where(items: Tuple[Tuple[str, Any], ...]) -> Dict[str, Any]:
+    """Build (and cache) the $and filter for sorted (field, value) pairs."""
+    return {"$and": [{key: value} for key, value in items]}
+
+@lru_cache(maxsize=None)
+def get_chroma_client(persist_directory: str):
+    """Return the shared persistent ChromaDB client for a directory."""
+    return chromadb.PersistentClient(
+        path=persist_directory,
+        settings=Settings(
+            anonymized_telemetry=False,
+            allow_reset=True
+        )
+    )
+
 class ChromaVectorDB:
     """ChromaDB-based vector database for storing and searching float metadata embeddings."""
     
-    def __init__(self, persist_directory: str = "./chroma_db", collection_name: str = "argo_floats"):
+    # add_vectors and search L2-normalize every embedding, so inner product is
+    # cosine similarity without a per-query normalization step in the index
+    COLLECTION_METADATA = {
+        "description": "ARGO float metadata embeddings",
+        "hnsw:space": "ip",
+        "embedding_model": f"{EMBEDDING_MODEL}/{EMBEDDING_DIMENSION}"
+    }
+    
+    def __init__(self, persist_directory: str = "./chroma_db", collection_name: str = "argo_floats",
+                 expected_count: int = VECTOR_EXPECTED_COUNT):
         """
         Initialize ChromaDB vector database.
         
         Args:
             persist_directory: Directory to persist the database
             collection_name: Name of the collection to store embeddings
+            expected_count: Expected collection size, used to size the HNSW
+                index of newly created collections
         """
         self.persist_directory = persist_directory
         self.collection_name = collection_name
+        self.collection_metadata = {**self.COLLECTION_METADATA, **hnsw_build_params(expected_count)}
+        self._count_cache: Optional[int] = None
+        self._count_expires_at = 0.0
         
         # Initialize ChromaDB client with persistence
-        self.client = chromadb.PersistentClient(
-            path=persist_directory,
-            settings=Settings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
-        )
+        self.client = get_chroma_client(persist_directory)
         
         # Get or create collection
         try:
@@ -41,39 +132,100 @@ class ChromaVectorDB:
         except:
             self.collection = self.client.create_collection(
                 name=collection_name,
-                metadata={"description": "ARGO float metadata embeddings"}
+                metadata=self.collection_metadata
             )
             logger.info(f"Created new collection '{collection_name}'")
+        
+        # Optional quantized IVF index (PQ, int8 or fp16) used for top-k search on large collections
+        self.quantized_index = QuantizedIndex(persist_directory, EMBEDDING_DIMENSION)
+        
+        # All embeddings of a small collection, loaded on first exact search.
+        # They are also kept as a raw float32 file (plus an ID list) next to
+        # ChromaDB and memory-mapped, so restarts skip re-reading them from sqlite
+        self._exact_path = os.path.join(persist_directory, f"{collection_name}_exact.f32")
+        self._exact_ids_path = os.path.join(persist_directory, f"{collection_name}_exact_ids.json")
+        self._exact_matrix: Optional[np.ndarray] = None
+        self._exact_ids: List[str] = []
+        self._exact_id_set = set()
+        self._exact_lock = threading.Lock()
+        
+        # Vectors from another embedding model (or dimension) cannot be compared
+        # with new query embeddings. This runs at import in every worker, so
+        # the collection is only flagged here; sync_databases/bulk_backfill
+        # drop and re-embed it (see reset_if_stale)
+        collection_metadata = self.collection.metadata or {}
+        self.stale = self._holds_other_model(collection_metadata)
+        if self.stale:
+            logger.warning(
+                f"Collection '{collection_name}' holds embeddings from another model than "
+                f"'{self.COLLECTION_METADATA['embedding_model']}'; run /maintenance/sync "
+                f"or /maintenance/backfill to re-embed its {self.count()} vectors"
+            )
+        
+        # The distance metric is fixed at creation; migrate empty collections
+        space = collection_metadata.get("hnsw:space", "l2")
+        if space != self.COLLECTION_METADATA["hnsw:space"]:
+            if self.count() == 0:
+                self.clear()
+            else:
+                logger.warning(
+                    f"Collection '{collection_name}' uses '{space}' distance; "
+                    f"call clear() and re-ingest to switch to inner product"
+                )
     
-    def add_vectors(self, embeddings: List[List[float]], metadatas: List[Dict[str, Any]], 
+    def add_vectors(self, embeddings: Union[np.ndarray, List[List[float]]], metadatas: List[Dict[str, Any]], 
                    documents: List[str] = None) -> List[str]:
         """
         Add vectors and corresponding metadata to the database.
+        Embeddings are L2-normalized here, so callers may pass raw model output.
+        IDs are derived from the float_id (see vector_id), so re-adding a
+        float, even with changed metadata, overwrites its vector instead of
+        storing a duplicate.
         
         Args:
-            embeddings: List of embedding vectors
+            embeddings: Embedding vectors, ideally a float32 matrix of shape (N, dimension)
             metadatas: List of metadata dictionaries for each vector
             documents: Optional list of source documents
             
         Returns:
-            List of generated IDs for the added vectors
+            List of IDs of the stored vectors
         """
         try:
-            # Generate unique IDs for each vector
-            ids = [str(uuid.uuid4()) for _ in range(len(embeddings))]
+            embeddings = normalize_embeddings(embeddings)
             
             # Prepare documents if not provided
             if documents is None:
                 documents = [self._format_metadata_as_document(meta) for meta in metadatas]
             
-            # Add to ChromaDB collection
-            self.collection.add(
+            # One vector per ID; a batch repeating a float keeps its last copy
+            last_index = {}
+            for i, meta in enumerate(metadatas):
+                last_index[self.vector_id(meta)] = i
+            ids = list(last_index)
+            if len(ids) < len(metadatas):
+                keep = list(last_index.values())
+                embeddings = embeddings[keep]
+                metadatas = [metadatas[i] for i in keep]
+                documents = [documents[i] for i in keep]
+            
+            # Upsert into ChromaDB collection
+            self.collection.upsert(
                 embeddings=embeddings,
                 metadatas=metadatas,
                 documents=documents,
                 ids=ids
             )
             
+            # Upserts may replace existing vectors, so recount on next use
+            self._count_cache = None
+            self._append_exact(ids, embeddings)
+            
+            # Keep the quantized index in step, building it once the collection is large enough
+            if self.quantized_index.is_ready():
+                self.quantized_index.add(ids, embeddings)
+            elif self.quantized_index.should_build(self.count()):
+                self._build_quantized_index()
+            
             logger.info(f"Added {len(ids)} vectors to collection. Total vectors: {self.count()}")
             return ids
             
@@ -82,7 +234,10 @@ class ChromaVectorDB:
             raise
     
     def search(self, query_embedding: List[float], top_k: int = 5, 
-               where: Dict[str, Any] = None) -> List[Tuple[float, Dict[str, Any], str]]:
+               where: Dict[str, Any] = None,
+               include_documents: bool = False,
+               max_distance: Optional[float] = None,
+               formatter: Optional[HitFormatter] = None) -> List[Any]:
         """
         Search for similar vectors in the database.
         
@@ -90,38 +245,298 @@ class ChromaVectorDB:
             query_embedding: Query embedding vector
             top_k: Number of top results to return
             where: Optional metadata filter
+            include_documents: Whether to fetch each hit's document string
+            max_distance: Optional distance cutoff; farther hits are dropped
+                before their metadata is fetched
+            formatter: Optional function called with (distance, metadata,
+                document) to build each result directly from ChromaDB's output
             
         Returns:
-            List of tuples (distance, metadata, document) for top-k results
+            List of tuples (distance, metadata, document) for top-k results,
+            with distance = 1 - cosine similarity; document is None unless
+            include_documents is set. With a formatter, its results instead.
         """
         try:
-            if self.count() == 0:
+            count = self.count()
+            if count == 0:
                 return []
             
+            query_embedding = normalize_embeddings([query_embedding])[0]
+            where = canonical_where(where)
+            
+            # Unfiltered searches on small collections are exact; on large
+            # collections they go through the quantized index
+            if where is None and count <= EXACT_SEARCH_MAX_VECTORS:
+                return self._search_exact(query_embedding[np.newaxis, :], top_k, count,
+                                          include_documents, max_distance, formatter)[0]
+            if where is None and self.quantized_index.is_ready():
+                return self._search_quantized(query_embedding, top_k, include_documents,
+                                              max_distance, formatter)
+            
             # Perform similarity search
             results = self.collection.query(
                 query_embeddings=[query_embedding],
-                n_results=min(top_k, self.count()),
+                n_results=min(top_k, count),
                 where=where,
-                include=['metadatas', 'documents', 'distances']
+                include=self._query_include(include_documents)
             )
             
-            # Format results
-            formatted_results = []
-            if results['distances'] and results['metadatas'] and results['documents']:
-                for distance, metadata, document in zip(
-                    results['distances'][0], 
-                    results['metadatas'][0], 
-                    results['documents'][0]
-                ):
-                    formatted_results.append((distance, metadata, document))
-            
-            return formatted_results
+            if not results['distances']:
+                return []
+            return self._query_hits(results, include_documents, max_distance, formatter)[0]
             
         except Exception as e:
             logger.error(f"Search failed: {e}")
             raise
     
+    def search_batch(self, query_embeddings: List[List[float]], top_k: int = 5,
+                     include_documents: bool = False,
+                     formatter: Optional[HitFormatter] = None) -> List[List[Any]]:
+        """
+        Search for several query vectors at once.
+        ChromaDB runs all queries through the index in a single call, so
+        concurrent searches share one round-trip into the index.
+        
+        Args:
+            query_embeddings: Query embedding vectors
+            top_k: Number of top results to return per query
+            include_documents: Whether to fetch each hit's document string
+            formatter: Optional function building each result, as in search()
+            
+        Returns:
+            One list of (distance, metadata, document) tuples (or formatted
+            results) per query
+        """
+        try:
+            count = self.count()
+            if count == 0 or len(query_embeddings) == 0:
+                return [[] for _ in query_embeddings]
+            
+            query_embeddings = normalize_embeddings(query_embeddings)
+            
+            if count <= EXACT_SEARCH_MAX_VECTORS:
+                return self._search_exact(query_embeddings, top_k, count, include_documents,
+                                          formatter=formatter)
+            if self.quantized_index.is_ready():
+                return [
+                    self._search_quantized(embedding, top_k, include_documents, formatter=formatter)
+                    for embedding in query_embeddings
+                ]
+            
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=min(top_k, count),
+                include=self._query_include(include_documents)
+            )
+            
+            return self._query_hits(results, include_documents, formatter=formatter)
+            
+        except Exception as e:
+            logger.error(f"Batch search failed: {e}")
+            raise
+    
+    @staticmethod
+    def _query_include(include_documents: bool) -> List[str]:
+        """Fields to request from collection.query; documents only when asked for."""
+        return ['metadatas', 'distances'] + (['documents'] if include_documents else [])
+    
+    @staticmethod
+    def _query_hits(results: Dict[str, Any], include_documents: bool,
+                    max_distance: Optional[float] = None,
+                    formatter: Optional[HitFormatter] = None) -> List[List[Any]]:
+        """
+        Turn collection.query output into one list of hits per query, reading
+        ChromaDB's parallel lists positionally. Without a formatter, hits are
+        (distance, metadata, document) tuples.
+        """
+        hits = []
+        for i, distances in enumerate(results['distances'] or []):
+            metadatas = results['metadatas'][i]
+            documents = results['documents'][i] if include_documents and results['documents'] else repeat(None)
+            if max_distance is not None:
+                # Distances come back in ascending order
+                distances = distances[:bisect.bisect_right(distances, max_distance)]
+            if formatter is None:
+                hits.append(list(zip(distances, metadatas, documents)))
+            else:
+                hits.append(list(map(formatter, distances, metadatas, documents)))
+        return hits
+    
+    def _search_exact(self, query_embeddings: np.ndarray, top_k: int, count: int,
+                      include_documents: bool = False,
+                      max_distance: Optional[float] = None,
+                      formatter: Optional[HitFormatter] = None) -> List[List[Any]]:
+        """
+        Brute-force search over the cached embedding matrix of a small collection.
+        
+        Args:
+            query_embeddings: Normalized query embeddings, shape (Q, dimension)
+            top_k: Number of top results to return per query
+            count: Current collection size; a matrix of another size is reloaded
+            include_documents: Whether to fetch each hit's document string
+            max_distance: Optional distance cutoff applied before fetching metadata
+            formatter: Optional function building each result, as in search()
+            
+        Returns:
+            One list of hits per query
+        """
+        with self._exact_lock:
+            if self._exact_matrix is None:
+                self._load_exact()
+            if self._exact_matrix is None or len(self._exact_ids) != count:
+                data = self.collection.get(include=['embeddings'])
+                self._save_exact(
+                    list(data['ids']),
+                    np.asarray(data['embeddings'], dtype=np.float32).reshape(-1, EMBEDDING_DIMENSION)
+                )
+            matrix, ids = self._exact_matrix, self._exact_ids
+        
+        k = min(top_k, len(ids))
+        if k == 0:
+            return [[] for _ in query_embeddings]
+        
+        # Stored vectors are unit length, so inner product is cosine similarity
+        similarities = query_embeddings @ matrix.T
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        
+        results = []
+        for row, candidates in zip(similarities, top):
+            ranked = candidates[np.argsort(-row[candidates])]
+            if max_distance is not None:
+                ranked = ranked[row[ranked] >= 1.0 - max_distance]
+            results.append(self._fetch_hits([(1.0 - float(row[i]), ids[i]) for i in ranked],
+                                            include_documents, formatter))
+        return results
+    
+    def _load_exact(self) -> None:
+        """Memory-map the persisted exact-search matrix, if present and consistent with its IDs."""
+        try:
+            with open(self._exact_ids_path, 'rb') as f:
+                ids = orjson.loads(f.read())
+            if not ids or os.path.getsize(self._exact_path) != len(ids) * EMBEDDING_DIMENSION * 4:
+                return
+            self._exact_matrix = np.memmap(self._exact_path, dtype=np.float32, mode='r',
+                                           shape=(len(ids), EMBEDDING_DIMENSION))
+            self._exact_ids = ids
+            self._exact_id_set = set(ids)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Failed to load persisted exact-search matrix: {e}")
+    
+    def _save_exact(self, ids: List[str], matrix: np.ndarray) -> None:
+        """Cache the exact-search matrix and persist it; files are replaced atomically."""
+        self._exact_matrix = matrix
+        self._exact_ids = ids
+        self._exact_id_set = set(ids)
+        try:
+            matrix.tofile(self._exact_path + ".tmp")
+            os.replace(self._exact_path + ".tmp", self._exact_path)
+            with open(self._exact_ids_path + ".tmp", 'wb') as f:
+                f.write(orjson.dumps(ids))
+            os.replace(self._exact_ids_path + ".tmp", self._exact_ids_path)
+        except Exception as e:
+            logger.warning(f"Failed to persist exact-search matrix: {e}")
+    
+    def _append_exact(self, ids: List[str], embeddings: np.ndarray) -> None:
+        """
+        Append newly added vectors to the exact-search matrix and its file.
+        Overwritten IDs, a collection outgrowing exact search, or a file
+        changed by another process drop the matrix instead; the next exact
+        search rebuilds it from ChromaDB.
+        """
+        with self._exact_lock:
+            if self._exact_matrix is None:
+                self._load_exact()
+                if self._exact_matrix is None:
+                    return
+            
+            row_bytes = EMBEDDING_DIMENSION * 4
+            try:
+                if (len(self._exact_ids) + len(ids) > EXACT_SEARCH_MAX_VECTORS
+                        or not self._exact_id_set.isdisjoint(ids)
+                        or os.path.getsize(self._exact_path) != len(self._exact_ids) * row_bytes):
+                    self._drop_exact()
+                    return
+                
+                with open(self._exact_path, 'ab') as f:
+                    f.write(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+                all_ids = self._exact_ids + ids
+                with open(self._exact_ids_path + ".tmp", 'wb') as f:
+                    f.write(orjson.dumps(all_ids))
+                os.replace(self._exact_ids_path + ".tmp", self._exact_ids_path)
+                
+                self._exact_matrix = np.memmap(self._exact_path, dtype=np.float32, mode='r',
+                                               shape=(len(all_ids), EMBEDDING_DIMENSION))
+                self._exact_ids = all_ids
+                self._exact_id_set.update(ids)
+            except Exception as e:
+                logger.warning(f"Failed to append to exact-search matrix: {e}")
+                self._drop_exact()
+    
+    def _drop_exact(self) -> None:
+        """Forget the exact-search matrix and delete its files."""
+        self._exact_matrix = None
+        self._exact_ids = []
+        self._exact_id_set = set()
+        for path in (self._exact_path, self._exact_ids_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    
+    def _search_quantized(self, query_embedding: List[float], top_k: int,
+                          include_documents: bool = False,
+                          max_distance: Optional[float] = None,
+                          formatter: Optional[HitFormatter] = None) -> List[Any]:
+        """Search the quantized index, then fetch metadata (and documents) from ChromaDB."""
+        hits = self.quantized_index.search(np.asarray(query_embedding, dtype=np.float32), top_k)
+        if max_distance is not None:
+            hits = [hit for hit in hits if hit[0] <= max_distance]
+        return self._fetch_hits(hits, include_documents, formatter)
+    
+    def _fetch_hits(self, hits: List[Tuple[float, str]], include_documents: bool = False,
+                    formatter: Optional[HitFormatter] = None) -> List[Any]:
+        """Fetch metadata (and documents) for ranked (distance, id) hits, keeping their order."""
+        if not hits:
+            return []
+        
+        results = self.collection.get(
+            ids=[vector_id for _, vector_id in hits],
+            include=['metadatas'] + (['documents'] if include_documents else [])
+        )
+        documents = results['documents'] if include_documents else [None] * len(results['ids'])
+        by_id = {
+            vector_id: (metadata, document)
+            for vector_id, metadata, document in zip(
+                results['ids'], results['metadatas'], documents
+            )
+        }
+        
+        if formatter is None:
+            return [
+                (distance, *by_id[vector_id])
+                for distance, vector_id in hits
+                if vector_id in by_id
+            ]
+        return [
+            formatter(distance, *by_id[vector_id])
+            for distance, vector_id in hits
+            if vector_id in by_id
+        ]
+    
+    def flush(self) -> None:
+        """Write in-memory index state that is persisted lazily (the quantized index) to disk."""
+        self.quantized_index.flush()
+    
+    def _build_quantized_index(self) -> None:
+        """Train the quantized index on every embedding currently in the collection."""
+        try:
+            data = self.collection.get(include=['embeddings'])
+            self.quantized_index.build(data['ids'], np.asarray(data['embeddings'], dtype=np.float32))
+        except Exception as e:
+            logger.error(f"Failed to build quantized index: {e}")
+    
     def search_by_metadata(self, where: Dict[str, Any], limit: int = 10) -> List[Dict[str, Any]]:
         """
         Search by metadata filters only.
@@ -135,7 +550,7 @@ class ChromaVectorDB:
         """
         try:
             results = self.collection.get(
-                where=where,
+                where=canonical_where(where),
                 limit=limit,
                 include=['metadatas']
             )
@@ -146,13 +561,81 @@ class ChromaVectorDB:
             logger.error(f"Metadata search failed: {e}")
             return []
     
+    def get_existing_float_ids(self, float_ids: List[str], chunk_size: int = 1000) -> set:
+        """
+        Find which float IDs already have vectors.
+        
+        Args:
+            float_ids: Float IDs to check
+            chunk_size: Maximum number of IDs per $in filter
+            
+        Returns:
+            Set of float IDs present in the collection
+        """
+        existing = set()
+        for i in range(0, len(float_ids), chunk_size):
+            results = self.collection.get(
+                where={"float_id": {"$in": float_ids[i:i + chunk_size]}},
+                include=['metadatas']
+            )
+            existing.update(
+                metadata["float_id"] for metadata in results['metadatas'] or []
+                if metadata and "float_id" in metadata
+            )
+        return existing
+    
+    def filter_new_metadatas(self, metadatas: List[Dict[str, Any]],
+                             chunk_size: int = 1000) -> List[Dict[str, Any]]:
+        """
+        Drop metadata records whose vector is already stored, so callers can
+        skip embedding them. Records are matched on vector_id, i.e. on their
+        float_id when they have one: a float inserted before is skipped even
+        if its metadata has changed since. Within the batch, only the last
+        record of each float is kept, matching what add_vectors stores.
+        
+        Args:
+            metadatas: Metadata dictionaries about to be embedded and added
+            chunk_size: Maximum number of IDs per lookup
+            
+        Returns:
+            The records not yet in the collection, in input order
+        """
+        last_index = {}
+        for i, metadata in enumerate(metadatas):
+            last_index[self.vector_id(metadata)] = i
+        ids = list(last_index)
+        existing = set()
+        for i in range(0, len(ids), chunk_size):
+            existing.update(self.collection.get(ids=ids[i:i + chunk_size], include=[])['ids'])
+        return [metadatas[i] for vector_id, i in sorted(last_index.items(), key=lambda item: item[1])
+                if vector_id not in existing]
+    
     def count(self) -> int:
-        """Return number of vectors in the database."""
+        """Return number of vectors in the database (cached for up to VECTOR_COUNT_TTL seconds)."""
+        now = time.monotonic()
+        if self._count_cache is not None and now < self._count_expires_at:
+            return self._count_cache
         try:
-            return self.collection.count()
+            self._count_cache = self.collection.count()
+            self._count_expires_at = now + VECTOR_COUNT_TTL
+            return self._count_cache
         except:
             return 0
     
+    def warmup(self) -> None:
+        """Load the collection's segments so the first search doesn't pay for it."""
+        try:
+            count = self.count()
+            if count > 0:
+                self.collection.peek(limit=1)
+            if 0 < count <= EXACT_SEARCH_MAX_VECTORS:
+                with self._exact_lock:
+                    if self._exact_matrix is None:
+                        self._load_exact()
+            logger.info(f"Warmed up collection '{self.collection_name}'")
+        except Exception as e:
+            logger.warning(f"Collection warmup failed: {e}")
+    
     def clear(self) -> None:
         """Clear all vectors and metadata from the database."""
         try:
@@ -160,31 +643,84 @@ class ChromaVectorDB:
             self.client.delete_collection(name=self.collection_name)
             self.collection = self.client.create_collection(
                 name=self.collection_name,
-                metadata={"description": "ARGO float metadata embeddings"}
+                metadata=self.collection_metadata
             )
+            self.quantized_index.reset()
+            self._count_cache = None
+            with self._exact_lock:
+                self._drop_exact()
             logger.info("Vector database cleared")
         except Exception as e:
             logger.error(f"Failed to clear database: {e}")
     
+    def reset_if_stale(self) -> bool:
+        """
+        Drop the collection if it holds another model's embeddings, so it
+        can be re-embedded from SQL.
+        
+        Returns:
+            True if the collection was dropped
+        """
+        if not self.stale:
+            return False
+        # Another worker may have re-created the collection in the meantime
+        self.collection = self.client.get_collection(name=self.collection_name)
+        self.stale = self._holds_other_model(self.collection.metadata or {})
+        if not self.stale:
+            self._count_cache = None
+            return False
+        logger.warning(f"Dropping {self.count()} stale vectors from '{self.collection_name}'")
+        self.clear()
+        self.stale = False
+        return True
+    
+    def _holds_other_model(self, collection_metadata: Dict[str, Any]) -> bool:
+        """
+        Whether the collection's vectors come from another embedding model.
+        Collections created before the model was recorded are judged by the
+        dimension of a stored vector.
+        """
+        model = collection_metadata.get("embedding_model")
+        if model is not None:
+            return model != self.COLLECTION_METADATA["embedding_model"]
+        try:
+            sample = self.collection.get(limit=1, include=['embeddings'])['embeddings']
+        except Exception as e:
+            logger.warning(f"Could not check the embedding dimension of '{self.collection_name}': {e}")
+            return False
+        return sample is not None and len(sample) > 0 and len(sample[0]) != EMBEDDING_DIMENSION
+    
     def get_collection_info(self) -> Dict[str, Any]:
         """Get information about the collection."""
         try:
             return {
                 "name": self.collection_name,
                 "count": self.count(),
-                "persist_directory": self.persist_directory
+                "persist_directory": self.persist_directory,
+                "stale": self.stale
             }
         except Exception as e:
             logger.error(f"Failed to get collection info: {e}")
             return {}
     
-    def _format_metadata_as_document(self, metadata: Dict[str, Any]) -> str:
+    @staticmethod
+    def vector_id(metadata: Dict[str, Any]) -> str:
+        """
+        Deterministic vector ID: a hash of the float_id when the record has
+        one, so every version of a float's metadata maps to the same vector,
+        and otherwise a hash of the whole metadata with sorted keys.
+        """
+        float_id = metadata.get("float_id")
+        if float_id is not None and float_id != "":
+            content = f"float_id:{float_id}".encode()
+        else:
+            content = orjson.dumps(metadata, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
+    
+    @staticmethod
+    def _format_metadata_as_document(metadata: Dict[str, Any]) -> str:
         """Format metadata dictionary as a document string."""
-        parts = []
-        for key, value in metadata.items():
-            if value is not None:
-                parts.append(f"{key}: {value}")
-        return " | ".join(parts)
+        return " | ".join(f"{key}: {value}" for key, value in metadata.items() if value is not None)
 
 
 # Global ChromaDB instance
@@ -0,0 +1,16 @@
+-- Latest known position per float, used by GET /api/floats.
+-- Profiles are append-only, so the DISTINCT ON aggregate is materialized once
+-- and refreshed after ingestion instead of being recomputed on every request.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS latest_profile_per_float AS
+SELECT DISTINCT ON (float_id)
+    float_id,
+    lat,
+    lon,
+    profile_time
+FROM profiles
+ORDER BY float_id, profile_time DESC;
+
+-- Required by REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS ix_latest_profile_per_float_float_id
+    ON latest_profile_per_float (float_id);
@@ -0,0 +1,13 @@
+-- Composite indexes for fetch_float_profiles, which filters on float_id
+-- (and optionally variable_name) and orders by profile_time.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_profiles_float_time
+    ON profiles (float_id, profile_time);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_profiles_float_var_time
+    ON profiles (float_id, variable_name, profile_time);
+
+-- The primary keys already have unique btrees; drop the duplicate
+-- non-unique indexes created by index=True on the PK columns.
+DROP INDEX CONCURRENTLY IF EXISTS ix_profiles_profile_id;
+DROP INDEX CONCURRENTLY IF EXISTS ix_floats_float_id;
@@ -0,0 +1,32 @@
+-- Promote the known measurements out of JSONB into typed columns so NL
+-- queries filter and aggregate on plain columns instead of parsing JSON.
+
+ALTER TABLE profiles ADD COLUMN IF NOT EXISTS temperature DOUBLE PRECISION;
+ALTER TABLE profiles ADD COLUMN IF NOT EXISTS salinity DOUBLE PRECISION;
+
+-- Backfill from raw_profile, falling back to the long-format variable columns.
+-- raw_profile values are free-form, so only numeric-looking strings are cast;
+-- anything else (e.g. "NaN", "", fill markers) is treated as missing.
+UPDATE profiles SET
+    temperature = COALESCE(
+        CASE WHEN raw_profile->>'TEMP' ~ '^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'
+             THEN (raw_profile->>'TEMP')::double precision END,
+        CASE WHEN raw_profile->>'temperature' ~ '^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'
+             THEN (raw_profile->>'temperature')::double precision END,
+        CASE WHEN variable_name = 'TEMP' THEN variable_value END
+    ),
+    salinity = COALESCE(
+        CASE WHEN raw_profile->>'PSAL' ~ '^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'
+             THEN (raw_profile->>'PSAL')::double precision END,
+        CASE WHEN raw_profile->>'salinity' ~ '^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'
+             THEN (raw_profile->>'salinity')::double precision END,
+        CASE WHEN variable_name = 'PSAL' THEN variable_value END
+    ),
+    pressure = COALESCE(
+        pressure,
+        CASE WHEN raw_profile->>'PRES' ~ '^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'
+             THEN (raw_profile->>'PRES')::double precision END,
+        CASE WHEN raw_profile->>'pressure' ~ '^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'
+             THEN (raw_profile->>'pressure')::double precision END
+    )
+WHERE temperature IS NULL OR salinity IS NULL OR pressure IS NULL;
@@ -0,0 +1,20 @@
+-- Make latest_profile_per_float deterministic when several profiles of a
+-- float share its latest profile_time (every variable/level of a profile
+-- does). DISTINCT ON keeps a single row per float either way; the
+-- profile_id tie-breaker just pins which one, so lat/lon stay stable
+-- across refreshes.
+
+DROP MATERIALIZED VIEW IF EXISTS latest_profile_per_float;
+
+CREATE MATERIALIZED VIEW latest_profile_per_float AS
+SELECT DISTINCT ON (float_id)
+    float_id,
+    lat,
+    lon,
+    profile_time
+FROM profiles
+ORDER BY float_id, profile_time DESC, profile_id DESC;
+
+-- Required by REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX ix_latest_profile_per_float_float_id
+    ON latest_profile_per_float (float_id);
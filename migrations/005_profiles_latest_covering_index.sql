@@ -0,0 +1,16 @@
+-- Replace ix_profiles_float_time with a newest-first covering index.
+-- Its key order matches the latest_profile_per_float DISTINCT ON
+-- (float_id, profile_time DESC, profile_id DESC) and it carries lat/lon, so
+-- refreshing the view is an index-only scan instead of a seq scan + sort.
+-- fetch_float_profiles' (profile_time, profile_id) keyset order within a
+-- float is the same index scanned backwards.
+--
+-- Check with:
+--   EXPLAIN (ANALYZE, BUFFERS)
+--   SELECT DISTINCT ON (float_id) float_id, lat, lon, profile_time
+--   FROM profiles ORDER BY float_id, profile_time DESC, profile_id DESC;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_profiles_float_time_desc
+    ON profiles (float_id, profile_time DESC, profile_id DESC) INCLUDE (lat, lon);
+
+DROP INDEX CONCURRENTLY IF EXISTS ix_profiles_float_time;
@@ -0,0 +1,7 @@
+-- GIN index for containment queries on the free-form floats.properties
+-- metadata. Split out of 003 because CREATE INDEX CONCURRENTLY cannot run
+-- inside a transaction block: run this file on its own, in autocommit mode
+-- (e.g. psql -f without --single-transaction).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_floats_properties_gin
+    ON floats USING gin (properties);
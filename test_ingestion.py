@@ -0,0 +1,127 @@
+"""
+Tests for ingestion normalization and the dual storage SQL write paths.
+The database session is mocked, so no server is needed:
+
+    python -m pytest test_ingestion.py
+"""
+import asyncio
+from datetime import date, datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.services.dual_storage import dual_storage
+from app.services.ingestion_pipeline import DataIngestionPipeline
+
+# One float with two profiles, shaped like a JSON/JSONL source record
+SAMPLE_RECORD = {
+    "float_id": "5904471",
+    "platform_number": "5904471",
+    "deploy_date": "2023-01-15",
+    "region": "North Atlantic",
+    "lat": 45.5,
+    "lon": -30.2,
+    "profiles": [
+        {
+            "profile_id": "5904471_001_TEMP",
+            "profile_time": "2023-01-20T06:30:00",
+            "lat": "45.6",
+            "lon": -30.1,
+            "variable_name": "TEMP",
+            "variable_value": "12.5",
+            "pressure": "10.2"
+        },
+        {
+            "profile_id": "5904471_001_PSAL",
+            "profile_time": "2023-01-20T06:30:00",
+            "lat": 45.6,
+            "lon": -30.1,
+            "variable_name": "PSAL",
+            "variable_value": 35.1,
+            "depth": ""
+        }
+    ]
+}
+
+def _normalized_batch():
+    """Run the sample record through the pipeline's normalization."""
+    return DataIngestionPipeline()._validate_and_normalize_batch([SAMPLE_RECORD])
+
+def _mock_session():
+    """An AsyncSession stand-in that records executed statements."""
+    db = MagicMock()
+    db.execute = AsyncMock()
+    db.commit = AsyncMock()
+    db.rollback = AsyncMock()
+    return db
+
+def _ingest(db):
+    """Ingest the sample batch with the vector half stubbed out."""
+    with patch.object(dual_storage, "_store_in_vector", AsyncMock(return_value=True)):
+        return asyncio.run(dual_storage.ingest_float_data(_normalized_batch(), db))
+
+def test_profiles_are_normalized():
+    profiles = _normalized_batch()[0]["profiles"]
+
+    assert profiles[0]["profile_time"] == datetime(2023, 1, 20, 6, 30)
+    assert profiles[0]["lat"] == 45.6
+    assert profiles[0]["variable_value"] == 12.5
+    assert profiles[0]["pressure"] == 10.2
+    assert profiles[1]["depth"] is None
+    # Absent fields stay absent so ingest_float_data can fall back to variable_value
+    assert "temperature" not in profiles[0]
+
+def test_ingest_with_profiles_inserts_typed_rows():
+    db = _mock_session()
+
+    result = _ingest(db)
+
+    assert result["status"] == "success"
+    assert result["total_profiles"] == 2
+    # Floats first, then profiles, each as one executemany
+    profile_rows = db.execute.await_args_list[1].args[1]
+    assert [row["profile_time"] for row in profile_rows] == [datetime(2023, 1, 20, 6, 30)] * 2
+    assert profile_rows[0]["temperature"] == 12.5
+    assert profile_rows[1]["salinity"] == 35.1
+    db.commit.assert_awaited_once()
+
+def test_ingest_with_profiles_copies_typed_rows():
+    db = _mock_session()
+    raw_connection = MagicMock()
+    raw_connection.execute = AsyncMock()
+    raw_connection.copy_records_to_table = AsyncMock()
+    connection = MagicMock()
+    connection.get_raw_connection = AsyncMock(return_value=MagicMock(driver_connection=raw_connection))
+    db.connection = AsyncMock(return_value=connection)
+
+    # Force the COPY branch for the two sample profiles
+    with patch("app.services.dual_storage.PROFILE_COPY_THRESHOLD", 1):
+        result = _ingest(db)
+
+    assert result["status"] == "success"
+    copy_call = raw_connection.copy_records_to_table.await_args
+    assert copy_call.args[0] == "_staging_profiles"
+    rows = [dict(zip(copy_call.kwargs["columns"], record)) for record in copy_call.kwargs["records"]]
+    assert [row["profile_time"] for row in rows] == [datetime(2023, 1, 20, 6, 30)] * 2
+    assert rows[0]["lat"] == 45.6
+    assert rows[0]["temperature"] == 12.5
+    # Staging table creation, then the INSERT ... SELECT into profiles
+    assert "ON CONFLICT (profile_id) DO NOTHING" in raw_connection.execute.await_args_list[-1].args[0]
+    db.commit.assert_awaited_once()
+
+def test_csv_dates_are_parsed():
+    # pyarrow infers ISO date columns in CSV files as date32 (datetime.date)
+    pipeline = DataIngestionPipeline()
+
+    assert pipeline._parse_date(date(2023, 1, 15)) == datetime(2023, 1, 15)
+    assert pipeline._parse_date(datetime(2023, 1, 15, 6, 30)) == datetime(2023, 1, 15, 6, 30)
+    assert pipeline._parse_date("2023-01-15") == datetime(2023, 1, 15)
+
+def test_csv_deploy_dates_survive_normalization(tmp_path):
+    path = tmp_path / "floats.csv"
+    path.write_text("float_id,platform_number,deploy_date,lat,lon\n5904471,5904471,2023-01-15,45.5,-30.2\n")
+    pipeline = DataIngestionPipeline()
+
+    records = list(pipeline._iter_records_from_file(str(path), "csv"))
+    normalized = pipeline._validate_and_normalize_batch(records)
+
+    assert normalized[0]["float_id"] == "5904471"
+    assert normalized[0]["deploy_date"] == datetime(2023, 1, 15)
@@ -0,0 +1,38 @@
+"""
+Tests for the keyword-set query classifier used for routing:
+
+    python -m pytest test_query_classifier.py
+"""
+import pytest
+
+from app.services.semantic_service import classify_query_type
+
+# Fixed queries and the labels the original per-pattern regex classifier gave them
+CLASSIFIER_CASES = [
+    # Indicator words
+    ("Temperature", "numeric"),
+    ("latest profiles", "numeric"),
+    ("deep ocean floats for climate research", "semantic"),
+    ("the research program behind it", "semantic"),
+    ("Antarctic research floats measuring salinity", "mixed"),
+    ("North Atlantic deployment purpose", "mixed"),
+    # Multi-token numeric patterns: coordinates, units, comparisons
+    ("30 degrees south", "numeric"),
+    ("floats with temperature above 20 degrees", "numeric"),
+    ("Floats within 5 km of the coast", "numeric"),
+    ("profiles deeper than 1000 m", "numeric"),
+    ("readings greater than 35 psu", "numeric"),
+    ("values higher than average", "numeric"),
+    ("12.5 °C readings", "numeric"),
+    # Bare numbers are not indicators, and words only match whole
+    ("float 2902746", "semantic"),
+    ("describe float 2902746", "semantic"),
+    ("floats similar to 5904471", "semantic"),
+    ("lateral drift", "semantic"),
+    # No indicators at all defaults to semantic
+    ("show me everything", "semantic"),
+]
+
+@pytest.mark.parametrize("query,expected", CLASSIFIER_CASES)
+def test_classify_query_type(query, expected):
+    assert classify_query_type(query) == expected
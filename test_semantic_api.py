@@ -4,6 +4,7 @@ Run this after starting the FastAPI server to test the semantic search functiona
 """
 import requests
 import json
+import time
 
 # API base URL (adjust if needed)
 BASE_URL = "http://localhost:8000/api/semantic"
@@ -51,9 +52,27 @@ def test_embed_metadata():
         response = requests.post(f"{BASE_URL}/embed", json=sample_metadata)
         print(f"Status: {response.status_code}")
         print(f"Response: {json.dumps(response.json(), indent=2)}")
+        
+        # /embed only queues the batch; wait for it before searching for it
+        job_id = response.json().get("job_id")
+        if job_id:
+            wait_for_embed_job(job_id)
     except Exception as e:
         print(f"Error: {e}")
 
+def wait_for_embed_job(job_id, timeout=120, interval=1.0):
+    """Poll an /embed job until it is done or has failed."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = requests.get(f"{BASE_URL}/embed/status/{job_id}")
+        status = response.json().get("status")
+        if status in ("done", "error"):
+            print(f"Embed job {job_id}: {json.dumps(response.json(), indent=2)}")
+            return status
+        time.sleep(interval)
+    print(f"Embed job {job_id} did not finish within {timeout}s")
+    return None
+
 def test_semantic_search():
     """Test semantic search functionality."""
     print("\n=== Testing Semantic Search ===")
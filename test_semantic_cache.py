@@ -0,0 +1,44 @@
+"""
+Tests for the semantic cache's in-process ring buffer of recent queries:
+
+    python -m pytest test_semantic_cache.py
+"""
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.services.embedding_service import EMBEDDING_DIMENSION
+from app.services.semantic_cache import SemanticCache
+
+def _basis(i):
+    """Unit embedding along axis i; distinct axes have similarity 0."""
+    vector = np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
+    vector[i] = 1.0
+    return vector.tolist()
+
+def test_ring_buffer_evicts_oldest_first():
+    cache = SemanticCache("test_ring", memory_size=2)
+    for i in range(3):
+        cache._remember_recent(_basis(i), "", f"response {i}")
+
+    # The third entry overwrote the first row
+    assert cache._lookup_recent(_basis(0), "") is None
+    assert cache._lookup_recent(_basis(1), "") == "response 1"
+    assert cache._lookup_recent(_basis(2), "") == "response 2"
+
+def test_ring_buffer_matches_scope():
+    cache = SemanticCache("test_ring", memory_size=2)
+    cache._remember_recent(_basis(0), "top_k=5", "five")
+
+    assert cache._lookup_recent(_basis(0), "top_k=5") == "five"
+    assert cache._lookup_recent(_basis(0), "top_k=10") is None
+
+def test_ring_buffer_skips_expired_entries(monkeypatch):
+    cache = SemanticCache("test_ring", memory_size=2, ttl_seconds=60)
+    cache._remember_recent(_basis(0), "", "fresh")
+
+    later = time.time() + 61
+    monkeypatch.setattr("app.services.semantic_cache.time", SimpleNamespace(time=lambda: later))
+
+    assert cache._lookup_recent(_basis(0), "") is None
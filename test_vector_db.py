@@ -0,0 +1,66 @@
+"""
+Tests for the ChromaDB wrapper's filter handling and search paths:
+
+    python -m pytest test_vector_db.py
+"""
+import numpy as np
+import pytest
+
+from app.services.embedding_service import EMBEDDING_DIMENSION
+from app.services.vector_db import ChromaVectorDB, canonical_where
+
+def test_canonical_where_passes_empty_and_single_field_filters():
+    assert canonical_where(None) is None
+    assert canonical_where({}) is None
+    assert canonical_where({"region": "North Atlantic"}) == {"region": "North Atlantic"}
+    assert canonical_where({"$or": [{"region": "A"}, {"region": "B"}]}) == {"$or": [{"region": "A"}, {"region": "B"}]}
+
+def test_canonical_where_rewrites_multi_field_filters_as_and():
+    expected = {"$and": [{"float_id": "5904471"}, {"region": "North Atlantic"}]}
+
+    # Fields are sorted, so key order does not change the filter
+    assert canonical_where({"region": "North Atlantic", "float_id": "5904471"}) == expected
+    assert canonical_where({"float_id": "5904471", "region": "North Atlantic"}) == expected
+
+def test_canonical_where_handles_operator_conditions():
+    # Dict conditions are unhashable and skip the cache, with the same result shape
+    where = {"lat": {"$gte": 40}, "region": "North Atlantic"}
+
+    assert canonical_where(where) == {"$and": [{"lat": {"$gte": 40}}, {"region": "North Atlantic"}]}
+
+def _unit(*components):
+    """A unit vector of the embedding dimension with the given leading components."""
+    vector = np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
+    vector[:len(components)] = components
+    return vector / np.linalg.norm(vector)
+
+def _small_db(tmp_path):
+    """A collection small enough for exact search, holding four known vectors."""
+    db = ChromaVectorDB(persist_directory=str(tmp_path), collection_name="exact_test")
+    embeddings = np.stack([_unit(1, 0), _unit(1, 1), _unit(0, 1), _unit(-1, 0)])
+    db.add_vectors(embeddings, [{"float_id": float_id} for float_id in ("e0", "e01", "e1", "-e0")])
+    return db, embeddings
+
+def test_exact_search_ranks_by_similarity(tmp_path):
+    db, embeddings = _small_db(tmp_path)
+    query = _unit(1, 0.2)
+
+    hits = db.search(query.tolist(), top_k=3)
+
+    # Same ranking and distances as a brute-force cosine ranking
+    similarities = embeddings @ query
+    expected = np.argsort(-similarities)[:3]
+    assert [metadata["float_id"] for _, metadata, _ in hits] == ["e0", "e01", "e1"]
+    assert [distance for distance, _, _ in hits] == pytest.approx(1.0 - similarities[expected], abs=1e-5)
+
+def test_exact_search_reloads_when_the_collection_grows(tmp_path):
+    db, _ = _small_db(tmp_path)
+    db.search(_unit(1, 0).tolist(), top_k=1)
+
+    # Another writer adds a vector behind this process's cached matrix
+    db.collection.upsert(ids=["new"], embeddings=[_unit(1, 0.1).tolist()], metadatas=[{"float_id": "new"}])
+    db._count_cache = None
+
+    hits = db.search(_unit(1, 0.1).tolist(), top_k=1)
+
+    assert hits[0][1]["float_id"] == "new"